@@ -1,72 +1,232 @@
+import time
 import streamlit as st
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
 from htmlTemplates import css, bot_template, user_template
-from langchain.llms import HuggingFaceHub
+from embedding_cache import CachedEmbeddings
+from answer_cache import get_answer_cache
+from embedding_backends import get_embeddings
+from index_store import (BackendMismatchError, DocumentIndex, UnknownBackendError, confirm_backend, document_hash,
+                         index_lock, list_indexes)
+from index_pool import get_index_pool
+from settings import EMBEDDING_BACKEND_LABELS, load_settings
+from pdf_extract import iter_pdf_pages
+from chunker import iter_chunks
+from bm25 import RETRIEVAL_K, HybridRetriever
+from context_packing import CONTEXT_TOKEN_BUDGET
+from tokens import token_length
+from openai_client import get_client
+from job_ui import follow_job, job_done, latest_job, submit_job
+from jobs import FINISHED
+from tracing import set_page, span, traced_iter
+
+# Aantal tokens chatgeschiedenis dat letterlijk meegaat naar het model
+MEMORY_TOKEN_BUDGET = 1000
+CHAT_MODEL = "gpt-3.5-turbo"
 
 def get_pdf_text(pdf_docs):
-    text = ""
+    return "".join(page.text for page in traced_iter("pdf_parse", iter_pdf_pages(pdf_docs)))
+
+
+def get_text_chunks(pages, unit="tekens"):
+    # Chunks behouden hun bron (bestand en pagina), zodat antwoorden die kunnen noemen
+    if unit == "tokens":
+        return traced_iter("chunk", iter_chunks(pages, chunk_size=250, chunk_overlap=50, length_function=token_length()))
+    return traced_iter("chunk", iter_chunks(pages, chunk_size=1000, chunk_overlap=200, length_function=len))
+
+
+def get_index(index_name, backend, compression):
+    # Gedeeld met andere sessies via de index pool, die ook een nieuwe versie na
+    # verwerken oppakt. Bij een andere index begint het gesprek opnieuw.
+    index = get_index_pool().get(index_name, backend, compression)
+    if st.session_state.get("index_key") != (index_name, backend):
+        st.session_state.index_key = (index_name, backend)
+        st.session_state.chat_memory = None
+    return index
+
+
+def get_vectorstore(index, pdf_docs, chunk_unit="tekens", progress=None):
+    skipped = []
+    index.embeddings.reset_stats()
+    index.embeddings.embeddings.progress = progress
     for pdf in pdf_docs:
-        pdf_reader = PdfReader(pdf)
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-    return text
-
-
-def get_text_chunks(text):
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    return chunks
+        doc_hash = document_hash(pdf.getvalue())
+        if index.has_document(doc_hash):
+            skipped.append(pdf.name)
+            continue
+        text_chunks = get_text_chunks(traced_iter("pdf_parse", iter_pdf_pages([pdf])), chunk_unit)
+        index.add_document(doc_hash, pdf.name, text_chunks)
+    index.save()
+    return index.vectorstore, skipped
+
 
+def process_documents(job, index_name, backend, pdf_docs, chunk_unit):
+    # Draait als achtergrond job met een eigen DocumentIndex: de sessie kan de
+    # vorige versie blijven doorzoeken tot de job klaar is
+    with index_lock(index_name):
+        index = DocumentIndex(index_name, CachedEmbeddings(get_embeddings(backend)), backend=backend)
+        job.publish(index=index.name)
+        index.open(mmap=False)
+        _, skipped = get_vectorstore(
+            index, pdf_docs, chunk_unit, lambda done, total: job.progress("Embedden", done, total))
+    return {"skipped": skipped, "cache": index.embeddings.stats()}
 
-def get_vectorstore(text_chunks):
-    embeddings = OpenAIEmbeddings()
-    # embeddings = HuggingFaceInstructEmbeddings(model_name="hkunlp/instructor-xl")
-    vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-    return vectorstore
 
+def remove_documents(index_name, backend, doc_hashes):
+    # Net als process_documents op een eigen, schrijfbare kopie; sessies houden
+    # de gedeelde versie tot de pool de nieuwe oppakt
+    with index_lock(index_name):
+        index = DocumentIndex(index_name, CachedEmbeddings(get_embeddings(backend)), backend=backend)
+        index.open(mmap=False)
+        for doc_hash in doc_hashes:
+            index.remove_document(doc_hash)
+        index.save()
 
-def get_conversation_chain(vectorstore):
-    llm = ChatOpenAI()
+
+def get_conversation_chain(index, retrieval_k=RETRIEVAL_K, dense_weight=1.0, sparse_weight=1.0,
+                           context_tokens=CONTEXT_TOKEN_BUDGET, memory_token_budget=MEMORY_TOKEN_BUDGET):
+    # langchain.chains en de chat modellen kosten seconden om te importeren; pas
+    # laden als er echt een gesprek opgebouwd wordt, niet bij elke eerste render.
+    # De keten wordt per vraag rond de gedeelde index gebouwd en niet in de sessie
+    # bewaard; alleen het gespreksgeheugen hoort bij de sessie.
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.chat_models import ChatOpenAI
+    from langchain.memory import ConversationSummaryBufferMemory
+    from chat_callbacks import LLMTracer, PromptTokenCounter, StreamHandler
+
+    st.session_state.stream_handler = StreamHandler()
+    st.session_state.token_counter = PromptTokenCounter()
+    tracer = LLMTracer(CHAT_MODEL)
+    # Beide modellen delen de connection pool van de gedeelde OpenAI client
+    client = get_client()
+    llm = ChatOpenAI(model_name=CHAT_MODEL, streaming=True, callbacks=[st.session_state.stream_handler, st.session_state.token_counter, tracer],
+                     http_client=client.http, openai_api_base=client.base_url, request_timeout=client.timeout)
     # llm = HuggingFaceHub(repo_id="google/flan-t5-xxl", model_kwargs={"temperature":0.5, "max_length":512})
+    helper_llm = ChatOpenAI(model_name=CHAT_MODEL, callbacks=[st.session_state.token_counter, tracer],
+                            http_client=client.http, openai_api_base=client.base_url, request_timeout=client.timeout)
 
-    memory = ConversationBufferMemory(
-        memory_key='chat_history', return_messages=True)
+    # Recente beurten blijven letterlijk bewaard; wat buiten het token budget valt
+    # wordt stapsgewijs in een lopende samenvatting opgenomen.
+    if st.session_state.get("chat_memory") is None:
+        st.session_state.chat_memory = ConversationSummaryBufferMemory(
+            llm=helper_llm, max_token_limit=memory_token_budget,
+            memory_key='chat_history', return_messages=True, output_key='answer')
+    else:
+        # De keten is nieuw per vraag; het geheugen moet de helper met de token
+        # teller en tracer van deze vraag gebruiken, niet die van de eerste
+        st.session_state.chat_memory.llm = helper_llm
     conversation_chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
-        retriever=vectorstore.as_retriever(),
-        memory=memory
+        # De herformulering van de vraag niet streamen, alleen het antwoord
+        condense_question_llm=helper_llm,
+        # Dense (FAISS) en BM25 resultaten samengevoegd met reciprocal rank fusion
+        retriever=HybridRetriever(vectorstore=index.vectorstore, bm25=index.bm25, k=retrieval_k,
+                                  dense_weight=dense_weight, sparse_weight=sparse_weight,
+                                  context_tokens=context_tokens),
+        memory=st.session_state.chat_memory,
+        return_source_documents=True
     )
     return conversation_chain
 
 
-def handle_userinput(user_question):
-    response = st.session_state.conversation({'question': user_question})
+def handle_userinput(user_question, index, retrieval_k=RETRIEVAL_K, dense_weight=1.0, sparse_weight=1.0,
+                     context_tokens=CONTEXT_TOKEN_BUDGET):
+    # Eerder gerenderde berichten staan als HTML in de sessie; alleen de nieuwe
+    # vraag en het antwoord worden opgebouwd.
+    rendered = st.session_state.rendered_messages
+    if rendered:
+        st.write("".join(rendered), unsafe_allow_html=True)
+    if user_question == st.session_state.get("last_question"):
+        if st.session_state.last_sources:
+            st.caption("Bronnen: " + st.session_state.last_sources)
+        return
+
+    user_html = user_template.replace("{{MSG}}", user_question)
+    st.write(user_html, unsafe_allow_html=True)
+    placeholder = st.empty()
+    started = time.perf_counter()
+
+    conversation = get_conversation_chain(index, retrieval_k, dense_weight, sparse_weight, context_tokens)
+    # Alleen zelfstandige vragen (zonder eerdere beurten) gaan via de answer cache;
+    # een vervolgvraag hangt af van de geschiedenis van dit gesprek.
+    cache = get_answer_cache()
+    use_cache = not st.session_state.chat_history
+    vector = None
+    if use_cache:
+        with span("answer_cache") as current:
+            entry, vector = cache.get(index.fingerprint(), user_question, index.embeddings.embed_query)
+            current.add(cache_hits=int(entry is not None), cache_misses=int(entry is None))
+        if entry is not None:
+            memory = conversation.memory
+            memory.save_context({'question': user_question}, {'answer': entry['answer']})
+            st.session_state.chat_history = memory.load_memory_variables({})['chat_history']
+            finished = time.perf_counter()
+            record_answer(placeholder, user_question, user_html, entry['answer'], entry['sources'])
+            st.session_state.question_timings.append({
+                "question": user_question,
+                "time_to_first_token": finished - started,
+                "total": finished - started,
+                "prompt_tokens": 0,
+                "cache_hit": True,
+            })
+            st.caption(f"Uit de antwoord cache in {(finished - started) * 1000:.0f}ms")
+            return
+
+    handler = st.session_state.stream_handler
+    handler.start(placeholder)
+    st.session_state.token_counter.reset()
+
+    # Retrieval ("retrieve", "pack_context") en elke LLM aanroep ("llm", met de
+    # modelaanroep en zijn kosten) leggen hun eigen spans vast
+    response = conversation({'question': user_question})
+    finished = time.perf_counter()
     st.session_state.chat_history = response['chat_history']
 
-    for i, message in enumerate(st.session_state.chat_history):
-        if i % 2 == 0:
-            st.write(user_template.replace(
-                "{{MSG}}", message.content), unsafe_allow_html=True)
-        else:
-            st.write(bot_template.replace(
-                "{{MSG}}", message.content), unsafe_allow_html=True)
+    sources = format_sources(response.get('source_documents', []))
+    record_answer(placeholder, user_question, user_html, response['answer'], sources)
+    if use_cache:
+        cache.put(index.fingerprint(), user_question, response['answer'], sources, vector)
+
+    time_to_first_token = (handler.first_token_at or finished) - started
+    packing = conversation.retriever.last_packing or {}
+    st.session_state.question_timings.append({
+        "question": user_question,
+        "time_to_first_token": time_to_first_token,
+        "total": finished - started,
+        "prompt_tokens": st.session_state.token_counter.prompt_tokens,
+        "context_tokens": packing.get("tokens"),
+        "top_k_tokens": packing.get("top_k_tokens"),
+        "cache_hit": False,
+    })
+    caption = (f"Eerste token na {time_to_first_token:.2f}s, antwoord compleet na {finished - started:.2f}s, "
+               f"{st.session_state.token_counter.prompt_tokens} prompt tokens")
+    if packing:
+        caption += (f"; context {packing['tokens']} tokens uit {packing['passages']} passages "
+                    f"(de bovenste {conversation.retriever.k} chunks los: {packing['top_k_tokens']} tokens)")
+    st.caption(caption)
+
+
+def record_answer(placeholder, user_question, user_html, answer, sources):
+    bot_html = bot_template.replace("{{MSG}}", answer)
+    placeholder.write(bot_html, unsafe_allow_html=True)
+    st.session_state.rendered_messages.extend([user_html, bot_html])
+    st.session_state.last_question = user_question
+    st.session_state.last_sources = sources
+    if sources:
+        st.caption("Bronnen: " + sources)
 
 
+def format_sources(documents):
+    cited = []
+    for doc in documents:
+        source = f"{doc.metadata.get('source', '?')} p. {doc.metadata.get('page', '?')}"
+        if source not in cited:
+            cited.append(source)
+    return ", ".join(cited)
+
 
 def run():
     load_dotenv()
+    set_page("Documenten_chat")
     st.title("WillemGPT🍺")  # Titel toegevoegd bovenaan de pagina
     st.write(css, unsafe_allow_html=True)
 
@@ -75,28 +235,81 @@ def run():
     with tab1:
         st.subheader("Upload je PDFs")
         st.markdown("""
-            Voeg 1 of meerdere pdf bestanden toe door ze te slepen of te selecteren. Voor de keuze van het [embeddings](https://en.wikipedia.org/wiki/Word_embedding) 
-                    model kun je de `get_vectorstore` functie gebruiken. Voor de keuze van het [LLM](https://en.wikipedia.org/wiki/Large_language_model) 
+            Voeg 1 of meerdere pdf bestanden toe door ze te slepen of te selecteren. Het [embeddings](https://en.wikipedia.org/wiki/Word_embedding) 
+                    model kies je op de Instellingen pagina. Voor de keuze van het [LLM](https://en.wikipedia.org/wiki/Large_language_model) 
                     gebruik je de `LLM` variabele in de `get_conversational_chain` functie.
                 
         """)
+        existing_indexes = list_indexes()
+        index_name = st.text_input(
+            "Naam van de index", value=existing_indexes[0] if existing_indexes else "documenten",
+            help="Opgeslagen indexen: " + (", ".join(existing_indexes) or "nog geen"))
+        settings = load_settings()
+        backend = settings["embedding_backend"]
+        try:
+            index = get_index(index_name, backend, settings["index_compression"])
+        except UnknownBackendError as e:
+            st.warning(f"{e}. Indexen van voor de backend keuze zijn met OpenAI gebouwd; "
+                       "met een andere backend zoeken geeft onzinnige resultaten.")
+            if st.button(f"Deze index is gebouwd met {EMBEDDING_BACKEND_LABELS[backend]}"):
+                confirm_backend(index_name, get_embeddings(backend), backend)
+                st.experimental_rerun()
+            st.stop()
+        except BackendMismatchError as e:
+            st.error(f"{e}. Kies de juiste embedding backend op de Instellingen pagina of gebruik een andere index.")
+            st.stop()
+        st.caption(f"Embedding backend: {EMBEDDING_BACKEND_LABELS[backend]}")
+
         pdf_docs = st.file_uploader("Kies bestanden", accept_multiple_files=True)
-        if st.button("Verwerken"):
-            with st.spinner("Verwerken..."):
-                raw_text = get_pdf_text(pdf_docs)
-                text_chunks = get_text_chunks(raw_text)
-                vectorstore = get_vectorstore(text_chunks)
-                st.session_state.conversation = get_conversation_chain(vectorstore)
+        chunk_unit = st.radio("Chunk grootte meten in", ["tekens", "tokens"], horizontal=True)
+        if st.button("Verwerken") and pdf_docs:
+            submit_job("documenten", process_documents, index_name, backend, pdf_docs, chunk_unit)
+        job = latest_job("documenten")
+        if job_done(job) and job["result"].get("index") == index.name:
+            stats = job["result"]["cache"]
+            st.caption(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
+            if job["result"]["skipped"]:
+                st.caption("Ongewijzigd en overgeslagen: " + ", ".join(job["result"]["skipped"]))
+
+        documents = index.documents()
+        if documents:
+            to_remove = st.multiselect(
+                "Documenten in deze index", options=list(documents),
+                format_func=lambda doc_hash: documents[doc_hash]["file"])
+            if st.button("Verwijder geselecteerde documenten") and to_remove:
+                with st.spinner("Verwijderen..."):
+                    remove_documents(index_name, backend, to_remove)
+                st.experimental_rerun()
+
+        with st.expander("Zoekinstellingen"):
+            context_tokens = st.slider(
+                "Token budget voor de context", 0, 4000, CONTEXT_TOKEN_BUDGET, 250,
+                help="Overlappende passages worden samengevoegd en dubbele weggelaten tot het budget vol is. "
+                     "Met 0 gaan de passages ongewijzigd mee.")
+            retrieval_k = st.slider("Aantal passages per vraag (zonder token budget)", 1, 10, RETRIEVAL_K)
+            dense_weight = st.slider("Gewicht semantisch zoeken (FAISS)", 0.0, 2.0, 1.0, 0.1)
+            sparse_weight = st.slider("Gewicht exact zoeken (BM25)", 0.0, 2.0, 1.0, 0.1)
 
     with tab2:
-        if "conversation" not in st.session_state:
-            st.session_state.conversation = None
         if "chat_history" not in st.session_state:
             st.session_state.chat_history = None
-
+        if "rendered_messages" not in st.session_state:
+            st.session_state.rendered_messages = []
+        if "question_timings" not in st.session_state:
+            st.session_state.question_timings = []
         user_question = st.text_input("Stel een vraag over je documenten:")
         if user_question:
-            handle_userinput(user_question)
+            if index.vectorstore is None:
+                st.info("Deze index bevat nog geen documenten. Verwerk eerst je PDFs in het eerste tabblad.")
+            else:
+                handle_userinput(user_question, index, retrieval_k, dense_weight, sparse_weight, context_tokens)
+
+    # Een lopende verwerking volgen in tab 1, nadat de chat al getoond is; bij een
+    # rerun loopt de job door en haakt deze run er weer aan
+    if job is not None and job["status"] not in FINISHED:
+        with tab1:
+            if job_done(follow_job(job["id"])):
+                st.experimental_rerun()
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -1,106 +1,118 @@
-# Just a copy of documentenchat for now. have to still build this. 
+import time
 
 import streamlit as st
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from htmlTemplates import css, bot_template, user_template
-from langchain.llms import HuggingFaceHub
-
-def get_pdf_text(pdf_docs):
-    text = ""
-    for pdf in pdf_docs:
-        pdf_reader = PdfReader(pdf)
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-    return text
-
-
-def get_text_chunks(text):
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    return chunks
-
-
-def get_vectorstore(text_chunks):
-    embeddings = OpenAIEmbeddings()
-    # embeddings = HuggingFaceInstructEmbeddings(model_name="hkunlp/instructor-xl")
-    vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-    return vectorstore
-
-
-def get_conversation_chain(vectorstore):
-    llm = ChatOpenAI()
-    # llm = HuggingFaceHub(repo_id="google/flan-t5-xxl", model_kwargs={"temperature":0.5, "max_length":512})
-
-    memory = ConversationBufferMemory(
-        memory_key='chat_history', return_messages=True)
-    conversation_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=vectorstore.as_retriever(),
-        memory=memory
-    )
-    return conversation_chain
-
-
-def handle_userinput(user_question):
-    response = st.session_state.conversation({'question': user_question})
-    st.session_state.chat_history = response['chat_history']
-
-    for i, message in enumerate(st.session_state.chat_history):
-        if i % 2 == 0:
-            st.write(user_template.replace(
-                "{{MSG}}", message.content), unsafe_allow_html=True)
-        else:
-            st.write(bot_template.replace(
-                "{{MSG}}", message.content), unsafe_allow_html=True)
-
+from index_pool import get_index_pool
+from index_store import list_indexes
+from settings import EMBEDDING_BACKEND_LABELS, INDEX_COMPRESSION_LABELS, load_settings, save_settings
+from audio_cache import get_audio_cache
+from tracing import get_trace_store
+
+PERIODS = {"Laatste uur": 3600, "Laatste 24 uur": 24 * 3600, "Laatste 7 dagen": 7 * 24 * 3600, "Alles": None}
+
+
+def format_summary(rows, first_columns):
+    return [
+        {
+            **{label: row[key] or "-" for key, label in first_columns},
+            "Aanroepen": row["calls"],
+            "Fouten": row["errors"],
+            "p50 (ms)": round(row["p50"] * 1000),
+            "p95 (ms)": round(row["p95"] * 1000),
+            "Tokens in": row["tokens_in"],
+            "Tokens uit": row["tokens_out"],
+            "Cache hits": "-" if row["cache_hit_rate"] is None else f"{row['cache_hit_rate']:.0%}",
+            "Retries": row["retries"],
+            "Kosten ($)": round(row["cost"], 4),
+        }
+        for row in rows
+    ]
+
+
+def show_performance():
+    # Uit de spans van tracing: per stap en per modelaanroep, en de kosten per pagina
+    st.subheader("Prestaties")
+    period = st.selectbox("Periode", list(PERIODS), index=1)
+    since = time.time() - PERIODS[period] if PERIODS[period] else 0.0
+    store = get_trace_store()
+
+    stages = store.summary(since)
+    if not stages:
+        st.caption("Nog geen metingen in deze periode.")
+    else:
+        # Kosten per pagina uit de modelaanroepen zelf; stappen kunnen genest zijn
+        pages = store.summary(since, kind="model", by=("page",))
+        # Zonder modelaanroepen (alles uit de cache) geen kolommen: st.columns(0) faalt
+        if pages:
+            for column, row in zip(st.columns(len(pages)), pages):
+                column.metric(row["page"] or "Overig", f"${row['cost']:.4f}", f"{row['calls']} aanroepen",
+                              delta_color="off")
+        st.dataframe(format_summary(stages, [("page", "Pagina"), ("name", "Stap")]), use_container_width=True)
+        st.caption("Per modelaanroep")
+        models = store.summary(since, kind="model", by=("name", "model"))
+        st.dataframe(format_summary(models, [("name", "Aanroep"), ("model", "Model")]), use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    col1.download_button("Exporteer spans (JSON regels)", store.export_jsonl(since), file_name="spans.jsonl",
+                         mime="application/x-ndjson")
+    if col2.button("Metingen wissen"):
+        store.clear()
+        st.experimental_rerun()
 
 
 def run():
     load_dotenv()
-    st.write(css, unsafe_allow_html=True)
-
-    # Creëer twee kolommen
-    col1, col2 = st.columns([3, 7])
-
-    with col1:
-        st.subheader("Tijdelijke documenten")
-        pdf_docs = st.file_uploader("Upload je PDFs hier en klik op verwerken", accept_multiple_files=True)
-        if st.button("Verwerken"):
-            with st.spinner("Verwerken"):
-                # get pdf text
-                raw_text = get_pdf_text(pdf_docs)
-
-                # get the text chunks
-                text_chunks = get_text_chunks(raw_text)
+    st.header("Instellingen ⚙️")
 
-                # create vector store
-                vectorstore = get_vectorstore(text_chunks)
+    settings = load_settings()
 
-                # create conversation chain
-                st.session_state.conversation = get_conversation_chain(vectorstore)
-
-    with col2:
-        st.header("WillemGPT :books:")
-        if "conversation" not in st.session_state:
-            st.session_state.conversation = None
-        if "chat_history" not in st.session_state:
-            st.session_state.chat_history = None
-
-        user_question = st.text_input("Stel een vraag over je documenten:")
-        if user_question:
-            handle_userinput(user_question)
+    st.subheader("Embeddings")
+    backends = list(EMBEDDING_BACKEND_LABELS)
+    backend = st.selectbox(
+        "Embedding backend voor nieuwe en bestaande indexen",
+        backends,
+        index=backends.index(settings["embedding_backend"]),
+        format_func=EMBEDDING_BACKEND_LABELS.get,
+    )
+    st.caption("Een index kan alleen doorzocht worden met de backend waarmee hij gebouwd is. "
+               "Opgeslagen indexen: " + (", ".join(list_indexes()) or "nog geen"))
+    compressions = list(INDEX_COMPRESSION_LABELS)
+    compression = st.selectbox(
+        "Compressie van de index in het geheugen",
+        compressions,
+        index=compressions.index(settings["index_compression"]),
+        format_func=INDEX_COMPRESSION_LABELS.get,
+    )
+    st.caption("De originele index blijft op schijf staan; de gecomprimeerde variant wordt bij het openen "
+               "gemaakt. Toevoegen en verwijderen van documenten gebeurt altijd op het origineel.")
+
+    st.subheader("Geopende indexen")
+    pool = get_index_pool().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Geheugen", f"{pool['bytes'] / 1024 ** 2:.1f} MB",
+                f"van {pool['max_bytes'] / 1024 ** 2:.0f} MB", delta_color="off")
+    col2.metric("Hergebruikt", pool["hits"], f"{pool['misses']} keer geladen", delta_color="off")
+    col3.metric("Uitgezet", pool["evictions"])
+    if pool["indexes"]:
+        st.dataframe([{"Index": entry["name"], "Compressie": entry["compression"], "Vectoren": entry["vectors"],
+                       "MB": round(entry["bytes"] / 1024 ** 2, 2)} for entry in pool["indexes"]])
+
+    st.subheader("Spraakcache")
+    stats = get_audio_cache().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Hit rate", f"{stats['hit_rate']:.0%}", f"{stats['hits']} hits, {stats['misses']} misses",
+                delta_color="off")
+    col2.metric("Bespaard", f"{stats['bytes_saved'] / 1024 ** 2:.1f} MB")
+    col3.metric("Gebruikt", f"{stats['size_bytes'] / 1024 ** 2:.1f} MB",
+                f"van {stats['max_bytes'] / 1024 ** 2:.0f} MB, {stats['entries']} segmenten", delta_color="off")
+
+    if st.button("Opslaan"):
+        settings["embedding_backend"] = backend
+        settings["index_compression"] = compression
+        save_settings(settings)
+        st.success("Instellingen opgeslagen")
+
+    show_performance()
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
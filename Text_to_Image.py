@@ -3,17 +3,13 @@
 
 import streamlit as st
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
 from htmlTemplates import css, bot_template, user_template
-from langchain.llms import HuggingFaceHub
+
+# PyPDF2 en langchain worden pas bij "Verwerken" geïmporteerd, zodat openen van de pagina snel blijft
 
 def get_pdf_text(pdf_docs):
+    from PyPDF2 import PdfReader
+
     text = ""
     for pdf in pdf_docs:
         pdf_reader = PdfReader(pdf)
@@ -23,6 +19,8 @@ def get_pdf_text(pdf_docs):
 
 
 def get_text_chunks(text):
+    from langchain.text_splitter import CharacterTextSplitter
+
     text_splitter = CharacterTextSplitter(
         separator="\n",
         chunk_size=1000,
@@ -34,6 +32,9 @@ def get_text_chunks(text):
 
 
 def get_vectorstore(text_chunks):
+    from langchain.embeddings import OpenAIEmbeddings
+    from langchain.vectorstores import FAISS
+
     embeddings = OpenAIEmbeddings()
     # embeddings = HuggingFaceInstructEmbeddings(model_name="hkunlp/instructor-xl")
     vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
@@ -41,6 +42,10 @@ def get_vectorstore(text_chunks):
 
 
 def get_conversation_chain(vectorstore):
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.chat_models import ChatOpenAI
+    from langchain.memory import ConversationBufferMemory
+
     llm = ChatOpenAI()
     # llm = HuggingFaceHub(repo_id="google/flan-t5-xxl", model_kwargs={"temperature":0.5, "max_length":512})
 
@@ -0,0 +1,91 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Antwoorden op vragen over dezelfde set documenten, gedeeld tussen alle
+# Streamlit sessies in dit proces. Eerst een exacte match op de genormaliseerde
+# vraag, daarna een match op embedding similarity boven SIMILARITY_THRESHOLD.
+MAX_ENTRIES = 1000
+TTL_SECONDS = 24 * 60 * 60
+SIMILARITY_THRESHOLD = 0.95
+
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
+
+class AnswerCache:
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, threshold=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint, question, embed_query=None):
+        # Geeft (entry, vector) terug; de vector kan bij put hergebruikt worden
+        key = (fingerprint, normalize_question(question))
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, entry["vector"]
+        if embed_query is None:
+            return None, None
+
+        vector = _unit(embed_query(question))
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for other_key, other in self._entries.items():
+                if other_key[0] != fingerprint or other["vector"] is None:
+                    continue
+                score = float(np.dot(vector, other["vector"]))
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+            if best_key is None:
+                return None, vector
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key], vector
+
+    def put(self, fingerprint, question, answer, sources="", vector=None):
+        key = (fingerprint, normalize_question(question))
+        with self._lock:
+            self._entries[key] = {
+                "question": question,
+                "answer": answer,
+                "sources": sources,
+                "vector": _unit(vector) if vector is not None else None,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in self._entries.items() if entry["created"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
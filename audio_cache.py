@@ -0,0 +1,86 @@
+import hashlib
+import os
+import re
+import threading
+
+from sqlite_lru import SqliteLRU
+
+# Gesynthetiseerde spraak per (tekstsegment, stem, model, formaat) op schijf, zodat
+# een script dat opnieuw (of deels gewijzigd) wordt voorgelezen alleen de
+# veranderde stukken naar de TTS API stuurt. Hits, misses en bespaarde bytes
+# worden in dezelfde database bijgehouden voor de Instellingen pagina.
+CACHE_PATH = os.getenv("AUDIO_CACHE_PATH", os.path.join(".cache", "tts_audio.sqlite3"))
+CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+def normalize_segment(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def audio_key(text, voice, model, response_format="mp3"):
+    digest = hashlib.sha256()
+    for part in (voice.lower(), model, response_format, normalize_segment(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.digest()
+
+
+class AudioCache(SqliteLRU):
+    # Audio staat als blob in SQLite, met daarnaast de tellers voor de statistieken.
+    table = "audio"
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            data = self._select([key]).get(key)
+            with self._conn:
+                if data is None:
+                    self._count(misses=1)
+                    return None
+                self._touch([key])
+                self._count(hits=1, bytes_saved=len(data))
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._insert([(key, data)])
+
+    def _count(self, **increments):
+        self._conn.executemany(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(increments.items()),
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = self._usage()
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "bytes_saved": stats.get("bytes_saved", 0),
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache()
+        return _cache
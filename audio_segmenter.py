@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+import subprocess
+import uuid
+
+# Splitst een podcast in segmenten van ongeveer TARGET_SECONDS zonder het hele
+# bestand in Python te decoderen. ffmpeg leest de audio als stream om stiltes te
+# vinden; de knippunten vallen in de stilte die het dichtst bij het doel ligt.
+# MP3 wordt zonder hercodering geknipt (-c copy), andere formaten worden per
+# segment naar MP3 gecodeerd. Het geheugengebruik hangt zo niet af van de lengte
+# van de aflevering.
+TARGET_SECONDS = 300
+SEARCH_WINDOW = 30  # zoek een stilte binnen zoveel seconden rond het doel
+SILENCE_DB = -35
+MIN_SILENCE = 0.4
+COPY_FORMATS = {".mp3"}
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+def spool_to_disk(uploaded_file, path, block_size=1024 * 1024):
+    # Kopieert in blokken en berekent tegelijk de content hash
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    with open(path, "wb") as out:
+        while True:
+            block = uploaded_file.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def probe_duration(path):
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return float(output.strip())
+
+
+def detect_silences(path, noise_db=SILENCE_DB, min_duration=MIN_SILENCE):
+    process = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", path,
+         "-af", f"silencedetect=noise={noise_db}dB:d={min_duration}", "-f", "null", "-"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    silences = []
+    start = None
+    for line in process.stderr:
+        match = _SILENCE_START.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg silencedetect faalde voor {path}")
+    return silences
+
+
+def choose_cut_points(duration, silences, target=TARGET_SECONDS, window=SEARCH_WINDOW):
+    cuts = [0.0]
+    midpoints = [(start + end) / 2 for start, end in silences]
+    while duration - cuts[-1] > target + window:
+        goal = cuts[-1] + target
+        candidates = [m for m in midpoints if abs(m - goal) <= window and m > cuts[-1] + window]
+        cuts.append(min(candidates, key=lambda m: abs(m - goal)) if candidates else goal)
+    cuts.append(duration)
+    return cuts
+
+
+def write_segment(source, start, end, out_path):
+    copy = os.path.splitext(source)[1].lower() in COPY_FORMATS
+    codec = ["-c", "copy"] if copy else ["-c:a", "libmp3lame", "-b:a", "128k"]
+    # Uniek per aanroep: sessies in hetzelfde proces kunnen hetzelfde segment exporteren
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.tmp.mp3"
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+         "-ss", f"{start:.3f}", "-i", source, "-t", f"{end - start:.3f}",
+         "-map", "0:a", *codec, tmp_path],
+        check=True,
+    )
+    os.replace(tmp_path, out_path)
+
+
+def segment_audio(source, out_dir, target=TARGET_SECONDS):
+    # Geeft (pad, start_ms, end_ms) per segment terug, met offsets in de hele aflevering
+    os.makedirs(out_dir, exist_ok=True)
+    duration = probe_duration(source)
+    cuts = choose_cut_points(duration, detect_silences(source), target)
+    segments = []
+    for i, (start, end) in enumerate(zip(cuts, cuts[1:]), start=1):
+        out_path = os.path.join(out_dir, f"part_{i}.mp3")
+        write_segment(source, start, end, out_path)
+        segments.append((out_path, int(start * 1000), int(end * 1000)))
+    return segments
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+
+from index_store import COMPRESSIONS, compress_index
+
+# Recall tegenover geheugen per compressie van de FAISS index. Vectoren zijn
+# genormaliseerde punten rond clusters (zoals embeddings van passages over
+# dezelfde onderwerpen); de exacte top-k van de float32 index is de referentie.
+#   python benchmarks/index_compression_benchmark.py --vectors 20000 --dims 1536
+#   python benchmarks/index_compression_benchmark.py --json resultaat.json
+
+
+def make_vectors(rng, count, dims, clusters):
+    centers = rng.standard_normal((clusters, dims)).astype("float32")
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dims)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def serialized_bytes(index):
+    return len(faiss.serialize_index(index))
+
+
+def run(count, dims, queries, k, clusters, seed):
+    rng = np.random.default_rng(seed)
+    vectors = make_vectors(rng, count, dims, clusters)
+    # Vragen liggen dicht bij bestaande passages, net als echte vragen
+    questions = vectors[rng.integers(0, count, queries)] + 0.3 * rng.standard_normal((queries, dims)).astype("float32")
+    questions /= np.linalg.norm(questions, axis=1, keepdims=True)
+
+    flat = faiss.IndexFlatL2(dims)
+    flat.add(vectors)
+    _, exact = flat.search(questions, k)
+    baseline = serialized_bytes(flat)
+
+    results = []
+    for mode in COMPRESSIONS:
+        started = time.perf_counter()
+        index, used = compress_index(flat, mode)
+        build = time.perf_counter() - started
+        latencies = []
+        found = 0
+        for question, expected in zip(questions, exact):
+            started = time.perf_counter()
+            _, ids = index.search(question[None, :], k)
+            latencies.append(time.perf_counter() - started)
+            found += len(set(ids[0]) & set(expected))
+        size = serialized_bytes(index)
+        results.append({
+            "mode": mode,
+            "used": used,
+            "bytes": size,
+            "bytes_per_vector": size / count,
+            "ratio": baseline / size,
+            "recall": found / (queries * k),
+            "p50_ms": statistics.median(latencies) * 1000,
+            "build_s": build,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall en geheugen per index compressie")
+    parser.add_argument("--vectors", type=int, default=10000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="schrijf de resultaten ook als JSON naar dit bestand")
+    args = parser.parse_args()
+
+    results = run(args.vectors, args.dims, args.queries, args.k, args.clusters, args.seed)
+    print(f"{args.vectors} vectoren van {args.dims} dimensies, {args.queries} vragen, k={args.k}")
+    for row in results:
+        mode = row["mode"] if row["used"] == row["mode"] else f"{row['mode']}->{row['used']}"
+        print(f"{mode:>16}: {row['bytes'] / 1024 ** 2:8.1f} MB  {row['bytes_per_vector']:7.0f} B/vector  "
+              f"{row['ratio']:5.1f}x  recall@{args.k} {row['recall']:.3f}  "
+              f"p50 {row['p50_ms']:.2f}ms  bouwen {row['build_s']:.1f}s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,449 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# End-to-end benchmark van alle pipelines, volledig offline. De testdata wordt
+# gegenereerd (PDFs, .eml mails zoals in "example emails", een WAV aflevering)
+# en alle API aanroepen gaan naar mock_openai met instelbare latency. Per stap
+# komen latency percentielen, doorvoer en piekgeheugen (tracemalloc, in een
+# aparte ronde zodat het meten de tijden niet beïnvloedt) in een JSON bestand.
+# Geheugen van worker processen (PDF extractie, mail parsing) telt niet mee.
+#   python benchmarks/pipeline_benchmark.py --latency 0.05 --json pipelines.json
+#   python benchmarks/pipeline_benchmark.py --latency 0.05 --baseline pipelines.json
+# Elke herhaling begint met lege caches; met --warm meten de herhalingen na de
+# eerste juist het gecachete pad. get_email_text heet nu iter_emails en
+# query_openai_with_context is opgesplitst in de map (summarize_emails) en de
+# reduce stap. split_and_save_audio heeft ffmpeg nodig; zonder ffmpeg wordt die
+# stap als fout gemeld en krijgt de transcriptie de segmenten van de generator.
+
+TTS_VOICE = "alloy"
+SCRIPT_PROMPT = "Create a short, lively podcast script that discusses these emails."
+SENDERS = ["Dwight K. Schrute <dwight@schrutefarms.com>", "Michael Scott <michael@dundermifflin.com>",
+           "Pam Beesly <pam@dundermifflin.com>", "Angela Martin <angela@dundermifflin.com>"]
+
+
+class Upload(io.BytesIO):
+    # Gedraagt zich als Streamlit's UploadedFile
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+        self.size = len(self.getvalue())
+
+
+def sentence(rng, words):
+    text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 16)))
+    return text[0].upper() + text[1:] + "."
+
+
+def make_pdf(path, pages):
+    # Minimale PDF: per pagina een tekststroom in Helvetica, genoeg voor PyPDF2
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({escape(line)}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {len(objects)} 0 R "
+                       "/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("ascii")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def make_eml(path, rng, words, number):
+    # Zelfde opbouw als de voorbeelden: platte tekst, een aanhef en een groet
+    sender = rng.choice(SENDERS)
+    body = "\n\n".join(" ".join(sentence(rng, words) for _ in range(rng.randint(2, 5)))
+                       for _ in range(rng.randint(2, 6)))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"From: {sender}\nTo: Jim Halpert <jim@dundermifflin.com>\n"
+                f"Subject: {' '.join(rng.choice(words) for _ in range(4)).capitalize()}\n"
+                f"Message-ID: <benchmark-{number}@dundermifflin.com>\n"
+                f"Date: Mon, {1 + number % 28:02d} Jan 2024 09:{number % 60:02d}:00 +0100\n"
+                f"Content-Type: text/plain; charset=utf-8\n\nBeste Jim,\n\n{body}\n\n"
+                f"Met vriendelijke groet,\n{sender.split(' <')[0]}\n")
+
+
+def write_wav(path, samples, rate):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.astype("<i2").tobytes())
+
+
+def make_audio(directory, rng, seconds, segment_seconds, rate=16000):
+    # "Spraak" (ruis met een omhullende) afgewisseld met stiltes waar ffmpeg kan knippen
+    np_rng = np.random.default_rng(rng.randint(0, 2 ** 32 - 1))
+    blocks = []
+    total = 0
+    while total < seconds * rate:
+        speech = int(rng.uniform(4, 12) * rate)
+        envelope = np.abs(np.sin(np.linspace(0, rng.uniform(8, 30), speech)))
+        blocks.append(np_rng.normal(0, 6000, speech) * envelope)
+        blocks.append(np.zeros(int(rng.uniform(0.5, 1.5) * rate)))
+        total += len(blocks[-2]) + len(blocks[-1])
+    samples = np.clip(np.concatenate(blocks)[:seconds * rate], -32768, 32767)
+    episode = os.path.join(directory, "aflevering.wav")
+    write_wav(episode, samples, rate)
+
+    segments = []
+    step = segment_seconds * rate
+    for i, start in enumerate(range(0, len(samples), step), start=1):
+        path = os.path.join(directory, f"segment_{i}.wav")
+        write_wav(path, samples[start:start + step], rate)
+        segments.append((path, start * 1000 // rate, min(len(samples), start + step) * 1000 // rate))
+    return episode, segments
+
+
+def generate_data(directory, args):
+    from retrieval_benchmark import FILLER, pseudo_word
+
+    rng = random.Random(args.seed)
+    words = FILLER + [pseudo_word(rng) for _ in range(2000)]
+    data = {"words": words}
+
+    os.makedirs(os.path.join(directory, "pdfs"))
+    data["pdfs"] = []
+    for d in range(args.pdfs):
+        path = os.path.join(directory, "pdfs", f"document_{d}.pdf")
+        make_pdf(path, [[sentence(rng, words) for _ in range(45)] for _ in range(args.pages)])
+        data["pdfs"].append(path)
+    data["questions"] = [f"Wat staat er over {' '.join(rng.sample(words[len(FILLER):], 3))}?"
+                         for _ in range(args.queries)]
+
+    os.makedirs(os.path.join(directory, "emails"))
+    data["emails"] = []
+    for i in range(args.emails):
+        path = os.path.join(directory, "emails", f"mail_{i}.eml")
+        make_eml(path, rng, words, i)
+        data["emails"].append(path)
+    # Het script van de mock is kort; voor de TTS stap een script van realistische lengte
+    data["script"] = "\n\n".join(" ".join(sentence(rng, words) for _ in range(4))
+                                 for _ in range(args.script_paragraphs))
+
+    os.makedirs(os.path.join(directory, "audio"))
+    data["episode"], data["segments"] = make_audio(
+        os.path.join(directory, "audio"), rng, args.audio_seconds, args.segment_seconds)
+    return data
+
+
+def reset_state(root):
+    # Alles wat een pipeline cachet of wegschrijft naar een verse map
+    import audio_cache
+    import disk_cache
+    import shownotes
+    import tts
+
+    os.makedirs(root, exist_ok=True)
+    disk_cache.CACHE_DIR = os.path.join(root, "results")
+    audio_cache._cache = audio_cache.AudioCache(os.path.join(root, "tts_audio.sqlite3"))
+    shownotes.podcast_parts_dir = os.path.join(root, "podcast_parts")
+    tts.SPEECH_DIR = os.path.join(root, "speech")
+    return root
+
+
+# Stappen in pipelinevolgorde: (naam, eenheid, functie, per). Zonder "per" wordt de
+# functie één keer per herhaling gemeten en geeft hij het aantal eenheden terug;
+# met "per" wordt hij voor elk element van ctx[per] apart gemeten.
+def stage_pdf_text(ctx):
+    from Documenten_chat import get_pdf_text
+    from pdf_extract import iter_pdf_pages
+
+    get_pdf_text(ctx["pdfs"])
+    ctx["pages"] = list(iter_pdf_pages(ctx["pdfs"]))  # invoer voor de volgende stap, niet gemeten
+    return len(ctx["pages"])
+
+
+def stage_text_chunks(ctx):
+    from Documenten_chat import get_text_chunks
+
+    return len(list(get_text_chunks(ctx["pages"])))
+
+
+def stage_vectorstore(ctx):
+    from Documenten_chat import get_vectorstore
+    from embedding_backends import get_embeddings
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+    from index_store import DocumentIndex
+
+    embeddings = CachedEmbeddings(get_embeddings(ctx["backend"]),
+                                  cache=EmbeddingCache(os.path.join(ctx["root"], "embeddings.sqlite3")))
+    ctx["index"] = DocumentIndex("benchmark", embeddings, root=os.path.join(ctx["root"], "indexes"),
+                                 backend=ctx["backend"])
+    get_vectorstore(ctx["index"], [Upload(path) for path in ctx["pdfs"]])
+    return ctx["index"].vectorstore.index.ntotal
+
+
+def stage_retrieval(ctx, question):
+    from bm25 import HybridRetriever
+
+    index = ctx["index"]
+    HybridRetriever(vectorstore=index.vectorstore, bm25=index.bm25).get_relevant_documents(question)
+    return 1
+
+
+def stage_email_text(ctx):
+    from email_ingest import iter_emails
+
+    ctx["records"] = [record for record in iter_emails([Upload(path) for path in ctx["emails"]]) if record.error is None]
+    return len(ctx["records"])
+
+
+def stage_summarize(ctx):
+    from dailyemailcast import summarize_emails
+
+    ctx["entries"], _ = summarize_emails(ctx["records"])
+    return len(ctx["entries"])
+
+
+def stage_script(ctx):
+    from dailyemailcast import condense_summaries, query_openai_with_context
+
+    query_openai_with_context(SCRIPT_PROMPT, "\n\n".join(condense_summaries(ctx["entries"])))
+    return len(ctx["entries"])
+
+
+def stage_tts(ctx):
+    from dailyemailcast import get_audio_tts
+
+    get_audio_tts(ctx["script"], TTS_VOICE)
+    return len(ctx["script"])
+
+
+def stage_split_audio(ctx):
+    from shownotes import split_and_save_audio
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg niet gevonden")
+    chunks = split_and_save_audio(Upload(ctx["episode"]))
+    return chunks[-1].end_ms // 1000
+
+
+def stage_transcript(ctx, segment):
+    from shownotes import get_transcript
+
+    ctx.setdefault("transcripts", []).append((get_transcript(segment[0], "nl"), segment))
+    return 1
+
+
+def stage_shownotes(ctx, transcript):
+    from shownotes import format_timecode, generate_shownotes
+
+    response, (_, start_ms, end_ms) = transcript
+    time_range = f"{format_timecode(start_ms)} tot {format_timecode(end_ms)}"
+    ctx.setdefault("shownotes", []).append(generate_shownotes(response, time_range, start_ms / 1000))
+    return 1
+
+
+def stage_consolidate(ctx):
+    from shownotes import consolidate_shownotes
+
+    consolidate_shownotes(ctx["shownotes"])
+    return len(ctx["shownotes"])
+
+
+STAGES = [
+    ("get_pdf_text", "pagina's", stage_pdf_text, None),
+    ("get_text_chunks", "chunks", stage_text_chunks, None),
+    ("get_vectorstore", "chunks", stage_vectorstore, None),
+    ("retrieval", "vragen", stage_retrieval, "questions"),
+    ("iter_emails", "mails", stage_email_text, None),
+    ("summarize_emails", "mails", stage_summarize, None),
+    ("query_openai_with_context", "mails", stage_script, None),
+    ("get_audio_tts", "tekens", stage_tts, None),
+    ("split_and_save_audio", "seconden", stage_split_audio, None),
+    ("get_transcript", "segmenten", stage_transcript, "segments"),
+    ("generate_shownotes", "segmenten", stage_shownotes, "transcripts"),
+    ("consolidate_shownotes", "shownotes", stage_consolidate, None),
+]
+
+
+def run_pipelines(data, root, backend, measurements, trace_memory=False):
+    ctx = dict(data, root=root, backend=backend)
+    for name, unit, fn, per in STAGES:
+        result = measurements.setdefault(name, {"unit": unit, "latencies": [], "items": 0, "peak": None, "error": None})
+        calls = [(fn, ())] if per is None else [(fn, (item,)) for item in list(ctx.get(per, []))]
+        for call, extra in calls:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            try:
+                items = call(ctx, *extra)
+            except Exception as exc:
+                # Een mislukte stap wordt gemeld; stappen die zijn uitvoer nodig hebben volgen vanzelf
+                result["error"] = f"{type(exc).__name__}: {exc}"
+                break
+            elapsed = time.perf_counter() - started
+            if trace_memory:
+                result["peak"] = max(result["peak"] or 0, tracemalloc.get_traced_memory()[1] - baseline)
+            else:
+                result["latencies"].append(elapsed)
+                result["items"] += items
+
+
+def summarize(measurements):
+    stages = {}
+    for name, result in measurements.items():
+        latencies = np.array(result["latencies"])
+        stage = {"unit": result["unit"], "calls": len(latencies), "items": result["items"],
+                 "peak_memory": result["peak"], "error": result["error"]}
+        if len(latencies):
+            stage.update(
+                p50=float(np.percentile(latencies, 50)),
+                p95=float(np.percentile(latencies, 95)),
+                p99=float(np.percentile(latencies, 99)),
+                mean=float(latencies.mean()),
+                throughput=result["items"] / latencies.sum() if latencies.sum() else 0.0,
+            )
+        stages[name] = stage
+    return stages
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    # Paden die de modules bij hun import lezen; relatieve paden van de app
+    # (.cache, podcast_parts) komen door de chdir ook in de tijdelijke map terecht
+    os.environ.update(DISK_CACHE_DIR=os.path.join(workdir, "cache"),
+                      EMBEDDING_CACHE_PATH=os.path.join(workdir, "embeddings.sqlite3"),
+                      AUDIO_CACHE_PATH=os.path.join(workdir, "tts_audio.sqlite3"),
+                      INDEX_DIR=os.path.join(workdir, "indexes"), JOBS_PATH=os.path.join(workdir, "jobs.sqlite3"),
+                      TRACES_PATH=os.path.join(workdir, "traces.sqlite3"))
+    os.chdir(workdir)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    import openai_client
+    from mock_openai import start_mock_server
+
+    server = start_mock_server(latency=args.latency, max_concurrent=args.max_concurrent)
+    # De gedeelde client (ook die van de embedding scheduler) naar de mock
+    openai_client._client = openai_client.OpenAIClient(server.base_url, "benchmark")
+    try:
+        data = generate_data(os.path.join(workdir, "data"), args)
+        measurements = {}
+        root = reset_state(os.path.join(workdir, "run_0"))
+        for repeat in range(args.repeats):
+            if repeat and not args.warm:
+                root = reset_state(os.path.join(workdir, f"run_{repeat}"))
+            run_pipelines(data, root, args.embedding_backend, measurements)
+
+        if not args.skip_memory:
+            tracemalloc.start()
+            try:
+                run_pipelines(data, reset_state(os.path.join(workdir, "run_memory")),
+                              args.embedding_backend, measurements, trace_memory=True)
+            finally:
+                tracemalloc.stop()
+    finally:
+        os.chdir(ROOT)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {"python": platform.python_version(), "latency": args.latency, "repeats": args.repeats,
+                 "warm": args.warm, "embedding_backend": args.embedding_backend, "api_requests": server.requests,
+                 "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024},
+        "stages": summarize(measurements),
+    }
+
+
+def compare(results, baseline, tolerance, min_delta, min_memory):
+    regressions = []
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None or "p50" not in before:
+            continue
+        if "p50" not in stage:
+            regressions.append(f"{name}: mislukt ({stage['error']})")
+            continue
+        for metric in ("p50", "p95"):
+            if stage[metric] - before[metric] > min_delta and stage[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {before[metric] * 1000:.1f}ms -> {stage[metric] * 1000:.1f}ms")
+        if before["throughput"] and stage["throughput"] < before["throughput"] / (1 + tolerance):
+            regressions.append(f"{name} doorvoer: {before['throughput']:.1f} -> {stage['throughput']:.1f} "
+                               f"{stage['unit']}/s")
+        if stage["peak_memory"] is None or before["peak_memory"] is None:
+            continue
+        if (stage["peak_memory"] - before["peak_memory"] > min_memory
+                and stage["peak_memory"] > before["peak_memory"] * (1 + tolerance)):
+            regressions.append(f"{name} piekgeheugen: {before['peak_memory'] / 1e6:.1f}MB -> "
+                               f"{stage['peak_memory'] / 1e6:.1f}MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark van alle pipelines tegen een lokale API")
+    parser.add_argument("--latency", type=float, default=0.05, help="gesimuleerde API latency per request (s)")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="429 van de mock boven dit aantal")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warm", action="store_true", help="caches tussen herhalingen niet leegmaken")
+    parser.add_argument("--skip-memory", action="store_true", help="geen tracemalloc ronde")
+    parser.add_argument("--embedding-backend", default="openai", choices=["openai", "hashing", "lokaal"])
+    parser.add_argument("--pdfs", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=10, help="pagina's per PDF")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--emails", type=int, default=60)
+    parser.add_argument("--script-paragraphs", type=int, default=12)
+    parser.add_argument("--audio-seconds", type=int, default=600)
+    parser.add_argument("--segment-seconds", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="schrijf de resultaten naar dit bestand")
+    parser.add_argument("--baseline", help="vergelijk met een eerder weggeschreven resultaat")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="toegestane relatieve verslechtering")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="kleinere latency verschillen (s) tellen niet")
+    parser.add_argument("--min-memory", type=int, default=1_000_000, help="kleinere geheugenverschillen (bytes) tellen niet")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print(f"{'stap':>26}  {'p50':>9}  {'p95':>9}  {'doorvoer':>18}  {'piekgeheugen':>12}")
+    for name, stage in results["stages"].items():
+        if "p50" not in stage:
+            print(f"{name:>26}  fout: {stage['error']}")
+            continue
+        print(f"{name:>26}  {stage['p50'] * 1000:7.1f}ms  {stage['p95'] * 1000:7.1f}ms  "
+              f"{stage['throughput']:9.1f} {stage['unit']:>8}/s  "
+              + (f"{stage['peak_memory'] / 1e6:10.1f}MB" if stage["peak_memory"] is not None else f"{'-':>12}"))
+    print(f"{results['meta']['api_requests']} API requests, piek RSS {results['meta']['peak_rss'] / 1e6:.0f}MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["latency"] != args.latency or baseline["meta"]["warm"] != args.warm:
+            print("Let op: de baseline is met een andere latency of cache instelling gemeten")
+        regressions = compare(results, baseline, args.tolerance, args.min_delta, args.min_memory)
+        for regression in regressions:
+            print("Regressie:", regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,145 @@
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema.embeddings import Embeddings
+
+from bm25 import HybridRetriever, dense_search
+from context_packing import CONTEXT_TOKEN_BUDGET
+from chunker import Chunk
+from index_store import DocumentIndex
+from embedding_backends import hash_embedding
+
+# Offline vergelijking van dense-only, BM25-only en hybride retrieval op een
+# synthetisch corpus. De helft van de vragen noemt een unieke referentiecode
+# (zoals artikelnummers in onze handboeken), de andere helft beschrijft het
+# onderwerp met synoniemen die letterlijk niet in de passage staan.
+#   python benchmarks/retrieval_benchmark.py --docs 50 --chunks 40 --queries 200
+
+FILLER = (
+    "de het een van voor met bij volgens regeling medewerker afdeling "
+    "aanvraag formulier termijn procedure beleid afspraak"
+).split()
+
+
+def pseudo_word(rng):
+    return "".join(rng.choice("bdfgklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(3, 4)))
+
+
+class ConceptEmbeddings(Embeddings):
+    # Stand-in voor een semantisch model: synoniemen worden naar hetzelfde begrip
+    # vertaald voordat de tekst gehasht wordt.
+    model = "concept-hash-embedding"
+
+    def __init__(self, synonyms, dimensions=1024):
+        self.synonyms = synonyms
+        self.dimensions = dimensions
+
+    def _canonical(self, text):
+        return " ".join(self.synonyms.get(word, word) for word in re.findall(r"\w+", text.lower()))
+
+    def embed_documents(self, texts):
+        return [hash_embedding(self._canonical(text), self.dimensions) for text in texts]
+
+    def embed_query(self, text):
+        return hash_embedding(self._canonical(text), self.dimensions)
+
+
+def build_corpus(rng, docs, chunks_per_doc, concepts=1500):
+    forms = [(pseudo_word(rng), pseudo_word(rng)) for _ in range(concepts)]
+    synonyms = {synonym: word for word, synonym in forms}
+    corpus = []
+    for d in range(docs):
+        for c in range(chunks_per_doc):
+            code = f"REF-{rng.randint(10000, 99999)}"
+            subject = rng.sample(forms, 4)
+            words = [word for word, _ in subject] * 2 + rng.choices(FILLER, k=30)
+            rng.shuffle(words)
+            text = f"Artikel {d}.{c} {' '.join(words)} zie {code}"
+            corpus.append((d, c, code, subject, text))
+    return corpus, synonyms
+
+
+def recall_at_k(retrieved, target):
+    return 1.0 if target in retrieved else 0.0
+
+
+def run(docs, chunks_per_doc, queries, k, seed, dense_weight=1.0, sparse_weight=1.0,
+        context_tokens=CONTEXT_TOKEN_BUDGET):
+    rng = random.Random(seed)
+    corpus, synonyms = build_corpus(rng, docs, chunks_per_doc)
+    with tempfile.TemporaryDirectory() as root:
+        index = DocumentIndex("benchmark", ConceptEmbeddings(synonyms), root=root)
+        for d in range(docs):
+            chunks = [Chunk(text, {"target": f"doc{doc}:{c}"}) for doc, c, _, _, text in corpus if doc == d]
+            index.add_document(f"doc{d}", f"doc{d}.pdf", chunks)
+        retriever = HybridRetriever(vectorstore=index.vectorstore, bm25=index.bm25, k=k,
+                                    dense_weight=dense_weight, sparse_weight=sparse_weight, context_tokens=0)
+        # Zelfde kandidaten, maar door pack_context tot het token budget
+        packer = HybridRetriever(vectorstore=index.vectorstore, bm25=index.bm25, k=k,
+                                 dense_weight=dense_weight, sparse_weight=sparse_weight,
+                                 context_tokens=context_tokens)
+
+        results = {"dense": ([], []), "bm25": ([], []), "hybrid": ([], []), "packed": ([], [])}
+        tokens = {"hybrid": [], "packed": []}
+        for _ in range(queries):
+            d, c, code, subject, _ = rng.choice(corpus)
+            target = f"doc{d}:{c}"
+            if rng.random() < 0.5:
+                question = f"Wat geldt er onder {code}?"
+            else:
+                question = f"Hoe zit het met {' '.join(synonym for _, synonym in subject[:3])}?"
+
+            started = time.perf_counter()
+            dense = [doc_id for doc_id, _ in dense_search(index.vectorstore, question, k)]
+            results["dense"][1].append(time.perf_counter() - started)
+            results["dense"][0].append(recall_at_k(dense, target))
+
+            started = time.perf_counter()
+            sparse = [doc_id for doc_id, _ in index.bm25.search(question, k)]
+            results["bm25"][1].append(time.perf_counter() - started)
+            results["bm25"][0].append(recall_at_k(sparse, target))
+
+            started = time.perf_counter()
+            hybrid = [doc.metadata["target"] for doc in retriever.get_relevant_documents(question)]
+            results["hybrid"][1].append(time.perf_counter() - started)
+            results["hybrid"][0].append(recall_at_k(hybrid, target))
+
+            started = time.perf_counter()
+            packed = packer.get_relevant_documents(question)
+            results["packed"][1].append(time.perf_counter() - started)
+            results["packed"][0].append(recall_at_k([doc.metadata["target"] for doc in packed], target))
+            tokens["packed"].append(packer.last_packing["tokens"])
+            tokens["hybrid"].append(packer.last_packing["top_k_tokens"])
+
+    print(f"{len(corpus)} passages, {queries} vragen, k={k}, "
+          f"gewichten dense {dense_weight} / bm25 {sparse_weight}")
+    for name, (recalls, latencies) in results.items():
+        latencies = sorted(latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(f"{name:>7}: recall@{k} {statistics.mean(recalls):.3f}  "
+              f"latency p50 {statistics.median(latencies) * 1000:.2f}ms  p95 {p95 * 1000:.2f}ms")
+    print(f"context: top-{k} gemiddeld {statistics.mean(tokens['hybrid']):.0f} tokens, "
+          f"gepakt met budget {context_tokens} gemiddeld {statistics.mean(tokens['packed']):.0f} tokens")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dense-only versus hybride retrieval")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dense-weight", type=float, default=1.0)
+    parser.add_argument("--sparse-weight", type=float, default=1.0)
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKEN_BUDGET)
+    args = parser.parse_args()
+    run(args.docs, args.chunks, args.queries, args.k, args.seed, args.dense_weight, args.sparse_weight,
+        args.context_tokens)
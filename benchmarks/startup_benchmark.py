@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Meet per pagina van de app de importtijd en de tijd van de eerste render, elk
+# in een vers proces (zoals na een cold start van de container). De render
+# draait in Streamlit's bare mode: elementen worden aangemaakt maar niet
+# getoond, uploads zijn leeg en st.session_state is een gewone dict (bare mode
+# heeft geen sessie). main.py gebruikt st_pages, dat een draaiende server nodig
+# heeft; daarvan meten we alleen de import. Schrijf een baseline weg en vergelijk later:
+#   python benchmarks/startup_benchmark.py --json startup.json
+#   python benchmarks/startup_benchmark.py --baseline startup.json
+PAGES = [
+    ("main", None),
+    ("Documenten_chat", "run"),
+    ("Text_to_Image", "run"),
+    ("shownotes", "run_streamlit_app"),
+    ("dailyemailcast", "run"),
+    ("Instellingen", "run"),
+]
+
+CHILD = """
+import json, logging, sys, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import streamlit
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+class SessionState(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    __setattr__ = dict.__setitem__
+
+
+streamlit.session_state = SessionState()
+streamlit_loaded = time.perf_counter()
+import {module} as page
+imported = time.perf_counter()
+error = None
+try:
+    if {entry!r}:
+        getattr(page, {entry!r})()
+except Exception as exc:
+    error = repr(exc)
+rendered = time.perf_counter()
+print(json.dumps({{"streamlit": streamlit_loaded - started, "import": imported - streamlit_loaded,
+                  "render": rendered - imported, "error": error}}))
+"""
+
+
+def measure(module, entry, workdir, env):
+    code = CHILD.format(root=ROOT, module=module, entry=entry)
+    result = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env,
+                            capture_output=True, text=True, timeout=300)
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    raise RuntimeError(f"{module} gaf geen meting:\n{result.stderr[-2000:]}")
+
+
+def run_benchmark(repeats):
+    workdir = tempfile.mkdtemp(prefix="startup_benchmark_")
+    # Alles wat de pagina's op schijf aanmaken gaat naar de tijdelijke map, en
+    # de hashing backend voorkomt netwerkverkeer bij het openen van een index
+    with open(os.path.join(workdir, "settings.json"), "w") as f:
+        json.dump({"embedding_backend": "hashing"}, f)
+    env = dict(os.environ,
+               SETTINGS_PATH=os.path.join(workdir, "settings.json"),
+               INDEX_DIR=os.path.join(workdir, "indexes"),
+               DISK_CACHE_DIR=os.path.join(workdir, "cache"),
+               EMBEDDING_CACHE_PATH=os.path.join(workdir, "embeddings.sqlite3"),
+               AUDIO_CACHE_PATH=os.path.join(workdir, "tts_audio.sqlite3"))
+
+    results = {}
+    for module, entry in PAGES:
+        runs = [measure(module, entry, workdir, env) for _ in range(repeats)]
+        results[module] = {
+            "import": statistics.median(run["import"] for run in runs),
+            "render": statistics.median(run["render"] for run in runs),
+            "streamlit": statistics.median(run["streamlit"] for run in runs),
+            "error": next((run["error"] for run in runs if run["error"]), None),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+    regressions = []
+    for module, result in results.items():
+        before = baseline.get(module)
+        if before is None:
+            continue
+        for metric in ("import", "render"):
+            delta = result[metric] - before[metric]
+            if delta > min_delta and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{module} {metric}: {before[metric] * 1000:.0f}ms -> {result[metric] * 1000:.0f}ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import- en eerste rendertijd per pagina")
+    parser.add_argument("--repeats", type=int, default=3, help="verse processen per pagina (mediaan)")
+    parser.add_argument("--json", help="schrijf de resultaten naar dit bestand")
+    parser.add_argument("--baseline", help="vergelijk met een eerder weggeschreven resultaat")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="toegestane relatieve vertraging")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="kleinere verschillen (s) tellen niet")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.repeats)
+    print(f"{'pagina':>16}  {'import':>8}  {'render':>8}  (streamlit zelf ~{results['main']['streamlit'] * 1000:.0f}ms)")
+    for module, result in results.items():
+        note = f"  fout: {result['error']}" if result["error"] else ""
+        print(f"{module:>16}  {result['import'] * 1000:6.0f}ms  {result['render'] * 1000:6.0f}ms{note}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta)
+        for regression in regressions:
+            print("Regressie:", regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,157 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, Optional
+
+import numpy as np
+from langchain.schema import BaseRetriever
+
+from context_packing import CONTEXT_TOKEN_BUDGET, MMR_LAMBDA, pack_context
+from tracing import span
+
+# Lokale BM25 index naast de FAISS index. Dense retrieval mist vaak exacte
+# treffers op codes, namen en artikelnummers; BM25 vindt die wel. De twee
+# ranglijsten worden samengevoegd met reciprocal rank fusion.
+K1 = 1.5
+B = 0.75
+RETRIEVAL_K = 4
+FETCH_K = 20
+RRF_K = 60
+
+# Woorden plus samengestelde codes als "7:611", "xk-4821" of "3.2.1"
+_TOKEN_RE = re.compile(r"\w+(?:[-./:]\w+)*")
+
+# Veelvoorkomende Nederlandse en Engelse woorden; die zouden vooral documenten
+# met veel lidwoorden bovenaan zetten en de fusie met dense resultaten vertroebelen.
+STOPWORDS = set("""
+de het een en van in is op te dat die voor met zijn er aan als bij ook om of
+naar dan nog wat hoe wie waar wel niet maar door over uit kan wordt werd tot
+dit deze ze zij hij ik je u we wij mijn moet mag zal zit
+the a an and of to in is on for with at by it be are was or as that this what how
+""".split())
+
+
+def tokenize(text):
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if match in STOPWORDS:
+            continue
+        tokens.append(match)
+        if not match.isalnum():
+            tokens.extend(part for part in re.split(r"[-./:]", match) if part)
+    return tokens
+
+
+class BM25Index:
+
+    def __init__(self, k1=K1, b=B):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        length = sum(counts.values())
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in list(self.postings):
+            docs = self.postings[term]
+            if docs.pop(doc_id, None) is not None and not docs:
+                del self.postings[term]
+
+    def remove_many(self, doc_ids):
+        doc_ids = {doc_id for doc_id in doc_ids if doc_id in self.doc_lengths}
+        if not doc_ids:
+            return
+        for doc_id in doc_ids:
+            self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for doc_id in doc_ids & docs.keys():
+                del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, k=FETCH_K):
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def dense_search(vectorstore, query, k=FETCH_K):
+    vector = np.array([vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+    scores, indices = vectorstore.index.search(vector, k)
+    return [
+        (vectorstore.index_to_docstore_id[i], float(score))
+        for i, score in zip(indices[0], scores[0])
+        if i != -1
+    ]
+
+
+def reciprocal_rank_fusion(rankings, weights=None, rrf_k=RRF_K):
+    weights = weights or [1.0] * len(rankings)
+    fused = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += weight / (rrf_k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    vectorstore: Any
+    bm25: Any
+    k: int = RETRIEVAL_K
+    fetch_k: int = FETCH_K
+    rrf_k: int = RRF_K
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+    # Met een token budget gaan alle fetch_k kandidaten door pack_context in
+    # plaats van de bovenste k; 0 geeft de k chunks zoals ze zijn
+    context_tokens: int = CONTEXT_TOKEN_BUDGET
+    mmr_lambda: float = MMR_LAMBDA
+    last_packing: Optional[dict] = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        with span("retrieve") as current:
+            dense = [doc_id for doc_id, _ in dense_search(self.vectorstore, query, self.fetch_k)]
+            sparse = [doc_id for doc_id, _ in self.bm25.search(query, self.fetch_k)]
+            fused = reciprocal_rank_fusion(
+                [dense, sparse], [self.dense_weight, self.sparse_weight], self.rrf_k)
+            documents = []
+            for doc_id in fused[:self.fetch_k if self.context_tokens else self.k]:
+                doc = self.vectorstore.docstore.search(doc_id)
+                if not isinstance(doc, str):  # InMemoryDocstore geeft een foutmelding als string
+                    documents.append(doc)
+            current.add(items=len(documents))
+        if self.context_tokens:
+            with span("pack_context") as current:
+                documents, self.last_packing = pack_context(documents, self.context_tokens, self.mmr_lambda,
+                                                           top_k=self.k)
+                current.add(items=len(documents))
+        return documents
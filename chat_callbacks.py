@@ -0,0 +1,85 @@
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from htmlTemplates import bot_template
+from tokens import count_tokens
+from tracing import finish_span, start_span
+
+
+class StreamHandler(BaseCallbackHandler):
+    # Schrijft tokens van het antwoord direct naar de pagina terwijl ze binnenkomen
+
+    def __init__(self):
+        self.placeholder = None
+        self.tokens = []
+        self.first_token_at = None
+
+    def start(self, placeholder):
+        self.placeholder = placeholder
+        self.tokens = []
+        self.first_token_at = None
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens.append(token)
+        if self.placeholder is not None:
+            self.placeholder.write(bot_template.replace(
+                "{{MSG}}", "".join(self.tokens) + "▌"), unsafe_allow_html=True)
+
+
+class PromptTokenCounter(BaseCallbackHandler):
+    # Telt de prompt tokens van alle LLM calls binnen één vraag (ook bij streaming,
+    # waar de API geen usage terugstuurt)
+
+    def __init__(self):
+        self.prompt_tokens = 0
+
+    def reset(self):
+        self.prompt_tokens = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_tokens += sum(count_tokens(m.content) for batch in messages for m in batch)
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.prompt_tokens += sum(count_tokens(prompt) for prompt in prompts)
+
+
+class LLMTracer(BaseCallbackHandler):
+    # ChatOpenAI praat direct met de HTTP client en niet via OpenAIClient.chat;
+    # deze callback legt elke LLM aanroep vast als stap "llm" met daarin een
+    # modelaanroep "chat", net als bij de andere pagina's. Bij streaming stuurt
+    # de API geen usage mee; dan tellen we zelf.
+
+    def __init__(self, model):
+        self.model = model
+        self._runs = {}  # run_id -> (stap, modelaanroep)
+
+    def _start(self, run_id, tokens_in):
+        stage = start_span("llm", items=1)
+        self._runs[run_id] = (stage, start_span("chat", kind="model", model=self.model, parent=stage,
+                                                tokens_in=tokens_in))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, sum(count_tokens(m.content) for batch in messages for m in batch))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, sum(count_tokens(prompt) for prompt in prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage, model = self._runs.pop(run_id, (None, None))
+        if model is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        text = "".join(generation.text for generations in response.generations for generation in generations)
+        model.set(tokens_in=usage.get("prompt_tokens", model.counts["tokens_in"]),
+                  tokens_out=usage.get("completion_tokens", count_tokens(text)))
+        finish_span(model)
+        finish_span(stage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        stage, model = self._runs.pop(run_id, (None, None))
+        if model is not None:
+            finish_span(model, error)
+            finish_span(stage, error)
@@ -0,0 +1,58 @@
+from dataclasses import dataclass, field
+
+# Chunker die pagina's als stream verwerkt: er staat nooit meer dan één chunk
+# plus de huidige pagina in het geheugen, en chunks lopen nooit over de grens
+# van een document heen.
+
+
+@dataclass
+class Chunk:
+    text: str
+    metadata: dict = field(default_factory=dict)
+
+
+def iter_chunks(pages, chunk_size=1000, chunk_overlap=200, length_function=len, separator="\n"):
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap moet kleiner zijn dan chunk_size")
+    separator_length = length_function(separator)
+    current_file = None
+    pieces = []  # (tekst, lengte, pagina, char offset)
+    total = 0
+
+    def emit():
+        text = separator.join(piece[0] for piece in pieces).strip()
+        first, last = pieces[0], pieces[-1]
+        return Chunk(text=text, metadata={
+            "source": current_file,
+            "page": first[2],
+            "end_page": last[2],
+            "start_index": first[3],
+        })
+
+    for page in pages:
+        if page.file != current_file or page.start == 0:
+            if pieces:
+                yield emit()
+            current_file = page.file
+            pieces, total = [], 0
+
+        offset = page.start
+        for piece in page.text.split(separator):
+            piece_start = offset
+            offset += len(piece) + len(separator)
+            if not piece.strip():
+                continue
+            length = length_function(piece)
+            joined = separator_length if pieces else 0
+            if pieces and total + joined + length > chunk_size:
+                yield emit()
+                # Houd het einde van de vorige chunk vast als overlap
+                while pieces and (total > chunk_overlap or total + separator_length + length > chunk_size):
+                    total -= pieces[0][1] + (separator_length if len(pieces) > 1 else 0)
+                    pieces.pop(0)
+                joined = separator_length if pieces else 0
+            pieces.append((piece, length, page.page, piece_start))
+            total += joined + length
+
+    if pieces:
+        yield emit()
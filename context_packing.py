@@ -0,0 +1,165 @@
+import re
+
+from langchain.schema import Document
+
+from tokens import count_tokens
+
+# Stelt de context voor het model samen uit de kandidaten van de retriever
+# (in volgorde van relevantie). Chunks overlappen 200 tekens, dus naburige
+# treffers herhalen elkaar: overlappende of aansluitende chunks uit hetzelfde
+# bestand worden weer één doorlopende passage, bijna-duplicaten vallen weg, en
+# met MMR (maximal marginal relevance) wordt een token budget gevuld met
+# relevante maar onderling verschillende passages.
+CONTEXT_TOKEN_BUDGET = 1000  # ongeveer wat 4 chunks van 1000 tekens eerder kostten
+MMR_LAMBDA = 0.7  # 1.0 is puur op relevantie, lager geeft meer spreiding
+MERGE_GAP = 20  # tekens tussen twee chunks die nog als aansluitend gelden
+DUPLICATE_THRESHOLD = 0.85  # deel van de kleinste passage dat ook in een betere voorkomt
+SHINGLE_SIZE = 3
+
+
+class Passage:
+
+    def __init__(self, text, metadata, rank, parts):
+        self.text = text
+        self.metadata = metadata
+        self.rank = rank  # beste positie van de onderdelen in de ranglijst
+        self.parts = parts  # originele chunks die in deze passage opgaan
+        self.shingles = _shingles(text)
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _overlap(first, second, expected):
+    # Lengte van het einde van first dat ook het begin van second is. Alleen als
+    # de offsets een overlap voorspellen: een toevallige match van een paar
+    # tekens bij aansluitende chunks zou anders tekst wegknippen.
+    if expected <= 0:
+        return 0
+    for length in range(min(expected, len(first), len(second)), 0, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _join(run):
+    # run: passages op volgorde van start_index die overlappen of aansluiten
+    text, metadata = run[0].text, dict(run[0].metadata)
+    for passage in run[1:]:
+        end = metadata["start_index"] + len(text)
+        next_start = passage.metadata["start_index"]
+        if next_start + len(passage.text) > end:  # anders valt hij er helemaal binnen
+            overlap = _overlap(text, passage.text, end - next_start)
+            text += ("" if overlap else "\n") + passage.text[overlap:]
+        metadata["end_page"] = max(metadata.get("end_page", 0), passage.metadata.get("end_page", 0))
+    return Passage(text, metadata, min(passage.rank for passage in run),
+                   [part for passage in run for part in passage.parts])
+
+
+def merge_chunks(passages):
+    # Overlappende of aansluitende passages uit hetzelfde bestand worden één
+    # passage (de invoer blijft ongewijzigd); het resultaat staat op relevantie
+    merged = []
+    by_source = {}
+    for passage in passages:
+        if passage.metadata.get("start_index") is None:
+            merged.append(passage)
+        else:
+            by_source.setdefault(passage.metadata.get("source"), []).append(passage)
+
+    for group in by_source.values():
+        group.sort(key=lambda passage: passage.metadata["start_index"])
+        runs = [[group[0]]]
+        for passage in group[1:]:
+            last = runs[-1][-1]
+            if passage.metadata["start_index"] > last.metadata["start_index"] + len(last.text) + MERGE_GAP:
+                runs.append([passage])
+            else:
+                runs[-1].append(passage)
+        for run in runs:
+            merged.append(run[0] if len(run) == 1 else _join(run))
+    merged.sort(key=lambda passage: passage.rank)
+    return merged
+
+
+def _containment(first, second):
+    return len(first.shingles & second.shingles) / max(1, min(len(first.shingles), len(second.shingles)))
+
+
+def _similarity(first, second):
+    return len(first.shingles & second.shingles) / max(1, len(first.shingles | second.shingles))
+
+
+def drop_duplicates(passages, threshold=DUPLICATE_THRESHOLD):
+    # Een passage die grotendeels al in een relevantere staat valt weg; die
+    # relevantere neemt haar onderdelen over
+    kept = []
+    dropped = 0
+    for passage in passages:
+        duplicate_of = next((other for other in kept if _containment(passage, other) >= threshold), None)
+        if duplicate_of is None:
+            kept.append(passage)
+        else:
+            duplicate_of.parts += passage.parts
+            dropped += 1
+    return kept, dropped
+
+
+def select_mmr(passages, budget, mmr_lambda=MMR_LAMBDA, length_function=count_tokens):
+    # Gulzig de chunk met de beste balans tussen relevantie en verschil met wat
+    # al gekozen is. Een chunk kost wat hij toevoegt na samenvoegen met de al
+    # gekozen buren, dus overlap telt niet dubbel. De meest relevante gaat
+    # altijd mee, ook als die alleen al groter is dan het budget.
+    count = len(passages)
+    remaining = list(passages)
+    selected, packed, used = [], [], 0
+    lengths = {}  # tekst -> tokens; de meeste passages blijven gelijk tussen pogingen
+
+    def length(text):
+        if text not in lengths:
+            lengths[text] = length_function(text)
+        return lengths[text]
+
+    # Grootste gelijkenis met een gekozen chunk, bijgewerkt na elke keuze
+    redundancy = {id(passage): 0.0 for passage in passages}
+
+    def score(passage):
+        relevance = 1 - passage.rank / max(1, count)
+        return mmr_lambda * relevance - (1 - mmr_lambda) * redundancy[id(passage)]
+
+    while remaining:
+        best = max(remaining, key=score)
+        remaining.remove(best)
+        trial = merge_chunks(selected + [best])
+        tokens = sum(length(passage.text) for passage in trial)
+        if selected and tokens > budget:
+            continue
+        selected.append(best)
+        packed, used = trial, tokens
+        for passage in remaining:
+            redundancy[id(passage)] = max(redundancy[id(passage)], _similarity(passage, best))
+    return packed, used
+
+
+def pack_context(documents, budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=MMR_LAMBDA, length_function=count_tokens,
+                 top_k=None):
+    # documents in volgorde van relevantie. Geeft (documenten, statistieken);
+    # top_k_tokens is wat de bovenste top_k chunks zonder packing kosten (de
+    # context die de retriever zonder budget meestuurt), zonder top_k alle.
+    passages = [Passage(doc.page_content, dict(doc.metadata), rank, [doc.page_content])
+                for rank, doc in enumerate(documents)]
+    passages, duplicates = drop_duplicates(passages)
+    packed, tokens = select_mmr(passages, budget, mmr_lambda, length_function)
+    stats = {
+        "candidates": len(documents),
+        "duplicates": duplicates,
+        "chunks": sum(len(passage.parts) for passage in packed),
+        "passages": len(packed),
+        "tokens": tokens,
+        "top_k_tokens": sum(length_function(doc.page_content) for doc in documents[:top_k]),
+    }
+    return [Document(page_content=passage.text, metadata=passage.metadata) for passage in packed], stats
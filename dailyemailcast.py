@@ -1,72 +1,172 @@
 import streamlit as st
-import email
-from email import policy
-from email.parser import BytesParser
-from openai import OpenAI  
-import requests
-from decouple import config
+from dotenv import load_dotenv
 from pathlib import Path  
+import hashlib
+import json
 import os
-
-def get_email_text(email_docs):
-    print("Extracting text from emails...")
-    text = ""
-    for email_file in email_docs:
-        msg = BytesParser(policy=policy.default).parsebytes(email_file.getvalue())
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                cdispo = str(part.get('Content-Disposition'))
-                if ctype == 'text/plain' and 'attachment' not in cdispo:
-                    text += part.get_payload(decode=True).decode()
-        else:
-            text += msg.get_payload(decode=True).decode()
-    return text
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai_client import get_client
+from email_ingest import EMAIL_IMPORT_DIR, iter_emails, list_local_mailboxes
+from disk_cache import get_cached, put_cached
+from tokens import count_tokens, pack_batches
+from tts import iter_speech, new_speech_path, write_speech
+from job_ui import follow_job, job_done, latest_job, submit_job
+from tracing import bind, set_page, span, traced_iter
+
+load_dotenv()
+
+# Map-reduce: mails worden in batches binnen MAP_BATCH_TOKENS parallel samengevat
+# (samenvattingen gecachet per mail), daarna maakt één aanroep het script in de
+# gekozen stijl. Past de som van de samenvattingen niet in REDUCE_TOKEN_BUDGET,
+# dan worden ze eerst groepsgewijs ingedikt.
+SUMMARY_MODEL = "gpt-3.5-turbo"
+SCRIPT_MODEL = "gpt-3.5-turbo"
+EMAIL_TOKEN_LIMIT = 1500  # een lange mail wordt afgekapt voor hij de batch in gaat
+MAP_BATCH_TOKENS = 6000
+MAP_BATCH_SIZE = 20
+SUMMARY_TOKENS = 120  # per mail in het antwoord
+REDUCE_TOKEN_BUDGET = 8000
+SCRIPT_TOKENS = 2000
+MAX_WORKERS = 4
+
+SUMMARY_PROMPT = ("Summarize each of the following emails in at most 3 sentences. Keep names, dates, numbers "
+                  "and requested actions. Do not add anything that is not in the email.")
+
+def truncate_tokens(text, limit):
+    tokens = count_tokens(text)
+    if tokens <= limit:
+        return text
+    return text[:len(text) * limit // tokens]
+
+
+def email_header(record):
+    header = f"From: {record.sender}\nSubject: {record.subject}"
+    if record.date:
+        header += f"\nDate: {record.date}"
+    return header
+
+
+def summary_cache_key(record):
+    text_hash = hashlib.sha256(record.text.encode("utf-8")).hexdigest()
+    return [record.message_id, text_hash, EMAIL_TOKEN_LIMIT, SUMMARY_MODEL, SUMMARY_PROMPT]
+
+
+def summarize_batch(records):
+    # Eén aanroep per batch, met een JSON lijst als antwoord zodat elke mail zijn
+    # eigen samenvatting (en cache entry) krijgt. Klopt het antwoord niet, dan per mail.
+    client = get_client()
+    if len(records) == 1:
+        record = records[0]
+        return [client.chat([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"{email_header(record)}\n\n{truncate_tokens(record.text, EMAIL_TOKEN_LIMIT)}"}
+        ], model=SUMMARY_MODEL, max_tokens=SUMMARY_TOKENS)]
+
+    emails = "\n\n".join(
+        f"### Email {i}\n{email_header(record)}\n\n{truncate_tokens(record.text, EMAIL_TOKEN_LIMIT)}"
+        for i, record in enumerate(records, start=1))
+    answer = client.chat([
+        {"role": "system", "content": SUMMARY_PROMPT + ' Answer with a JSON object {"summaries": [...]} '
+                                      "with exactly one string per email, in the given order."},
+        {"role": "user", "content": emails}
+    ], model=SUMMARY_MODEL, max_tokens=SUMMARY_TOKENS * len(records) + 50,
+        response_format={"type": "json_object"})
+    try:
+        summaries = json.loads(answer)["summaries"]
+    except (ValueError, KeyError, TypeError):
+        summaries = None
+    if not isinstance(summaries, list) or len(summaries) != len(records):
+        return [summary for record in records for summary in summarize_batch([record])]
+    return [str(summary) for summary in summaries]
+
+
+def summarize_emails(records, max_workers=MAX_WORKERS, progress=None):
+    # Geeft per mail "header + samenvatting" terug, in de volgorde van de records,
+    # en het aantal samenvattingen dat uit de cache kwam
+    summaries = [get_cached("email_summaries", summary_cache_key(record)) for record in records]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    texts = [email_header(records[i]) + "\n\n" + truncate_tokens(records[i].text, EMAIL_TOKEN_LIMIT) for i in missing]
+    batches = [[missing[j] for j in batch] for batch in pack_batches(texts, MAP_BATCH_TOKENS, MAP_BATCH_SIZE)]
+
+    done = len(records) - len(missing)
+    if progress:
+        progress(done, len(records))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(bind(summarize_batch), [records[i] for i in batch]): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            for i, summary in zip(batch, future.result()):
+                put_cached("email_summaries", summary_cache_key(records[i]), summary)
+                summaries[i] = summary
+            done += len(batch)
+            if progress:
+                progress(done, len(records))
+    entries = [f"{email_header(record)}\nSummary: {summary}" for record, summary in zip(records, summaries)]
+    return entries, len(records) - len(missing)
+
+
+def condense_summaries(entries, budget=REDUCE_TOKEN_BUDGET, max_workers=MAX_WORKERS):
+    # Groepen aangrenzende samenvattingen worden parallel ingedikt tot het geheel in het budget past
+    total = sum(count_tokens(entry) for entry in entries)
+    while len(entries) > 1 and total > budget:
+        groups = [[entries[j] for j in batch] for batch in pack_batches(entries, budget // 2, len(entries))]
+        if len(groups) == len(entries):
+            groups = [entries[i:i + 2] for i in range(0, len(entries), 2)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            entries = list(pool.map(bind(lambda group: get_client().chat([
+                {"role": "system", "content": "Condense these email summaries. Keep one entry per email with its "
+                                              "From and Subject lines, but shorten each summary to one sentence."},
+                {"role": "user", "content": "\n\n".join(group)}
+            ], model=SUMMARY_MODEL) if len(group) > 1 else group[0]), groups))
+        previous, total = total, sum(count_tokens(entry) for entry in entries)
+        if total >= previous:  # indikken helpt niet meer; dan maar zo
+            break
+    return entries
 
 
 def query_openai_with_context(prompt, context):
     print("Querying OpenAI with context and prompt...")
     combined_input = f"{context}\n\n{prompt}"
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {config('OPENAI_API_KEY')}"
-    }
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": combined_input}
-        ]
-    }
-
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        print("API-call failed, status code:", response.status_code)
-        print("Respons:", response.text)
-        return None
-
-def get_audio_tts(text, voice):
-    client = OpenAI()
-
-    # Path to audiofile
-    speech_file_path = Path(__file__).parent / "speech.mp3"
+    return get_client().chat([
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": combined_input}
+    ], model=SCRIPT_MODEL, max_tokens=SCRIPT_TOKENS)
 
-    # Call to OpenAI with selected voice.
-    response = client.audio.speech.create(
-        model="tts-1",
-        voice=voice.lower(), 
-        input=text
-    )
 
-    # safe audio to file
-    response.stream_to_file(speech_file_path)
+def generate_script(records, prompt, progress=None):
+    with span("summarize", items=len(records)) as current:
+        entries, cached = summarize_emails(records, progress=progress)
+        current.add(cache_hits=cached, cache_misses=len(records) - cached)
+    with span("condense", items=len(entries)):
+        context = "\n\n".join(condense_summaries(entries))
+    with span("llm", items=1):
+        return query_openai_with_context(prompt, context), cached
 
-    # return path to audiofile
-    return speech_file_path
+def get_audio_tts(text, voice):
+    # Parallel per stuk van het script (zie tts), samengevoegd in een uniek bestand
+    parts = [audio for _, _, audio in iter_speech(text, voice.lower())]
+    return write_speech(parts)
+
+def create_podcast(job, email_docs, prompt, voice):
+    # Draait als achtergrond job. Elk audiodeel wordt meteen als bestand
+    # gepubliceerd, zodat de pagina het kan afspelen terwijl de rest nog gemaakt wordt.
+    job.progress("Reading emails")
+    records = [record for record in traced_iter("email_parse", iter_emails(email_docs)) if record.error is None]
+    script, cached = generate_script(
+        records, prompt, progress=lambda done, total: job.progress("Summarizing emails", done, total))
+    job.publish(emails=len(records), cached=cached)
+
+    parts, part_paths = [], []
+    for i, total, audio in iter_speech(script, voice):
+        job.progress("Generating audio", i + 1, total)
+        path = new_speech_path()
+        with open(path, "wb") as f:
+            f.write(audio)
+        parts.append(audio)
+        part_paths.append(path)
+        job.publish(parts=part_paths)
+    return {"script": script, "audio": write_speech(parts)}
 
 def get_prompts():
     # Reed every prompt in the prompts folder and return prompts
@@ -80,9 +180,10 @@ def get_prompts():
 
 
 def run():
+    set_page("dailyemailcast")
     st.title("email podcast creator")
     st.markdown("""
-        upload your emails (as .eml) and click on process.
+        upload your emails (as .eml or .mbox) and click on process.
     """)
 
     # voice selector
@@ -92,23 +193,45 @@ def run():
     prompts = get_prompts()
     style = st.selectbox("Choose a podcast style", list(prompts.keys()))
 
-    email_docs = st.file_uploader("Choose email files", accept_multiple_files=True)
+    email_docs = st.file_uploader("Choose email files (.eml or .mbox)", accept_multiple_files=True)
+    # Grote exports (mbox of Maildir map) kunnen ook direct van schijf gelezen
+    # worden, maar alleen uit de map die de beheerder in EMAIL_IMPORT_DIR opgeeft
+    if EMAIL_IMPORT_DIR:
+        mailboxes = st.multiselect("Or mailboxes on the server (mbox or Maildir)", list_local_mailboxes())
+        email_docs = list(email_docs or []) + mailboxes
 
     if st.button("Process"):
-        with st.spinner("Processing..."):
-            raw_text = get_email_text(email_docs)
-            if style in prompts:
-                prompt = prompts[style]  # Use selecteed prompt
-                ai_output = query_openai_with_context(prompt, raw_text)
-                mp3_audio_path = get_audio_tts(ai_output, voice)  # Use selected voice
-                if mp3_audio_path:
-                    with open(mp3_audio_path, 'rb') as audio_file:
+        if style in prompts:
+            prompt = prompts[style]  # Use selecteed prompt
+            submit_job("emailcast", create_podcast, email_docs or [], prompt, voice.lower())  # Use selected voice
+        else:
+            st.write("Please select a style and voice to proceed.")
+
+    # De laatste job van deze gebruiker volgen, ook na een rerun of reconnect
+    job = latest_job("emailcast")
+    if job is not None:
+        rendered = {"summary": False, "parts": 0}
+
+        def show_progress(job):
+            result = job["result"]
+            if "emails" in result and not rendered["summary"]:
+                st.caption(f"{result['emails']} emails, {result['cached']} summaries from cache")
+                rendered["summary"] = True
+            if job_done(job):
+                return
+            # Elk deel is af te spelen zodra het binnen is, de rest wordt intussen gemaakt
+            for path in result.get("parts", [])[rendered["parts"]:]:
+                rendered["parts"] += 1
+                if os.path.exists(path):
+                    st.caption(f"Part {rendered['parts']}")
+                    with open(path, 'rb') as audio_file:
                         st.audio(audio_file.read(), format="audio/mpeg")
-                else:
-                    st.write("Error while generating audio.")
-            else:
-                st.write("Please select a style and voice to proceed.")
-            print("Processing complete.")
+
+        job = follow_job(job["id"], show_progress)
+        if job_done(job) and os.path.exists(job["result"]["audio"]):
+            st.markdown("**Full episode**")
+            with open(job["result"]["audio"], 'rb') as audio_file:
+                st.audio(audio_file.read(), format="audio/mpeg")
 
 if __name__ == "__main__":
     run()
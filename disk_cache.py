@@ -0,0 +1,31 @@
+import hashlib
+import json
+import os
+
+# Eenvoudige content-addressed cache op schijf voor JSON waarden. De sleutel is
+# een tuple met alles waar de uitkomst van afhangt (content hash, model, taal, ...).
+CACHE_DIR = os.getenv("DISK_CACHE_DIR", os.path.join(".cache", "results"))
+
+
+def cache_path(namespace, key):
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, digest[:2], digest + ".json")
+
+
+def get_cached(namespace, key):
+    path = cache_path(namespace, key)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def put_cached(namespace, key, value):
+    path = cache_path(namespace, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Schrijven via een uniek tijdelijk bestand, zodat gelijktijdige sessies elkaar niet raken
+    tmp_path = f"{path}.{os.getpid()}.{id(value)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,280 @@
+import email
+import hashlib
+import mailbox
+import os
+import re
+import shutil
+import tempfile
+from collections import deque
+from dataclasses import dataclass
+from email import policy
+from email.header import decode_header, make_header
+from email.utils import getaddresses, parsedate_to_datetime
+from html import unescape
+from html.parser import HTMLParser
+from itertools import islice
+from typing import Optional
+
+from process_pool import acquire_pool, release_pool
+
+# Leest een hele inbox (losse .eml bestanden, mbox exports of Maildir mappen) als
+# stream. Berichten worden in batches over een pool van processen geparsed en in
+# de oorspronkelijke volgorde teruggegeven als EmailRecord, zonder alles in één
+# string te bouwen. Dubbele berichten (zelfde Message-ID, of dezelfde tekst
+# binnen een thread) worden overgeslagen.
+MAX_WORKERS = int(os.getenv("EMAIL_WORKERS", os.cpu_count() or 1))
+BATCH_SIZE = 32  # berichten per taak; scheelt overhead per bericht tussen processen
+FALLBACK_CHARSETS = ("utf-8", "cp1252", "latin-1")
+# Map op de server waaruit grote exports (mbox of Maildir) direct gelezen mogen
+# worden. Zonder deze variabele kan alleen geüpload worden; een pad buiten deze
+# map of een ander soort bestand wordt nooit geopend.
+EMAIL_IMPORT_DIR = os.getenv("EMAIL_IMPORT_DIR")
+
+
+@dataclass
+class EmailRecord:
+    message_id: str
+    thread_id: str
+    subject: str
+    sender: str
+    date: Optional[str]  # ISO 8601
+    text: str
+    source: str
+    error: Optional[str] = None
+
+
+class _TextExtractor(HTMLParser):
+    # Eenvoudige HTML naar tekst: geen scripts en styles, regeleinden bij blokken
+    BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "table", "blockquote"}
+    SKIP = {"script", "style", "head", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = "".join(parser.parts)
+    except Exception:  # kapotte HTML: dan maar de tags wegknippen
+        text = unescape(re.sub(r"<[^>]+>", " ", html))
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    return re.sub(r"\s*\n\s*", "\n", text).strip()
+
+
+def decode_payload(part):
+    payload = part.get_payload(decode=True) or b""
+    charsets = [part.get_content_charset()] if part.get_content_charset() else []
+    for charset in charsets + list(FALLBACK_CHARSETS):
+        try:
+            return payload.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return payload.decode("utf-8", errors="replace")
+
+
+def _body_text(message):
+    plain, html = [], []
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        ctype = part.get_content_type()
+        if ctype == "text/plain":
+            plain.append(decode_payload(part))
+        elif ctype == "text/html":
+            html.append(decode_payload(part))
+    if plain:
+        return "\n".join(plain).strip()
+    return "\n".join(html_to_text(h) for h in html)
+
+
+# Citaten van eerdere berichten in een antwoord: "> ..." regels en alles na "Op ... schreef:"
+_QUOTE_HEADER = re.compile(r"^(On .+ wrote:|Op .+ schreef .+:|-----Original Message-----|-----Oorspronkelijk bericht-----)\s*$",
+                           re.IGNORECASE | re.MULTILINE)
+_SUBJECT_PREFIX = re.compile(r"^\s*((re|fw|fwd|aw|antw|wg)\s*:\s*)+", re.IGNORECASE)
+
+
+def strip_quotes(text):
+    match = _QUOTE_HEADER.search(text)
+    if match:
+        text = text[:match.start()]
+    return "\n".join(line for line in text.splitlines() if not line.lstrip().startswith(">")).strip()
+
+
+def normalize_subject(subject):
+    return _SUBJECT_PREFIX.sub("", subject or "").strip()
+
+
+def _message_ids(value):
+    return re.findall(r"<[^>]+>", value or "")
+
+
+def parse_message(raw, source=""):
+    try:
+        message = email.message_from_bytes(raw, policy=policy.compat32)
+        subject = str(make_header(decode_header(message.get("Subject", ""))))
+        sender = ", ".join(
+            f"{name} <{addr}>" if name else addr
+            for name, addr in getaddresses([str(make_header(decode_header(message.get("From", ""))))])
+        )
+        text = _body_text(message)
+        message_id = (_message_ids(message.get("Message-ID")) or [""])[0]
+        if not message_id:
+            # Zonder Message-ID is de inhoud de identiteit
+            message_id = "<sha256:" + hashlib.sha256(raw).hexdigest() + ">"
+        # De thread is de wortel van References, anders In-Reply-To, anders het onderwerp
+        references = _message_ids(message.get("References")) or _message_ids(message.get("In-Reply-To"))
+        thread_id = references[0] if references else f"subject:{normalize_subject(subject).lower()}"
+        try:
+            date = parsedate_to_datetime(message.get("Date")).isoformat()
+        except (TypeError, ValueError):
+            date = None
+        return EmailRecord(message_id, thread_id, subject, sender, date, strip_quotes(text), source)
+    except Exception as exc:  # één kapot bericht mag de rest van de inbox niet tegenhouden
+        return EmailRecord("<sha256:" + hashlib.sha256(raw).hexdigest() + ">", "", "", "", None, "",
+                           source, str(exc) or type(exc).__name__)
+
+
+def _parse_batch(batch):
+    return [parse_message(raw, source) for source, raw in batch]
+
+
+def _is_maildir(path):
+    return all(os.path.isdir(os.path.join(path, sub)) for sub in ("cur", "new"))
+
+
+def _looks_like_mbox(path):
+    with open(path, "rb") as f:
+        return f.read(5) == b"From "
+
+
+def list_local_mailboxes(root=EMAIL_IMPORT_DIR):
+    # Maildir mappen en mbox bestanden direct onder root, voor de keuzelijst
+    if not root or not os.path.isdir(root):
+        return []
+    names = []
+    for name in sorted(os.listdir(root)):
+        try:
+            resolve_mailbox(name, root)
+        except (OSError, ValueError):
+            continue
+        names.append(name)
+    return names
+
+
+def resolve_mailbox(name, root=EMAIL_IMPORT_DIR):
+    # Volledig pad van een mailbox onder root. Symlinks en ".." worden eerst
+    # opgelost, zodat niets buiten root gelezen kan worden; losse bestanden
+    # (.env, sleutels, ...) worden geweigerd, alleen Maildir en mbox mogen.
+    if not root:
+        raise ValueError("Lokale mailboxen zijn niet ingeschakeld (EMAIL_IMPORT_DIR)")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"{name} ligt niet in de map voor mailbox imports")
+    if os.path.isdir(path):
+        if not _is_maildir(path):
+            raise ValueError(f"{name} is geen Maildir map")
+    elif not (os.path.isfile(path) and _looks_like_mbox(path)):
+        raise ValueError(f"{name} is geen mbox bestand")
+    return path
+
+
+def _spool_uploads(email_docs, directory):
+    # (naam, pad, lokaal): lokale paden zijn namen van mailboxen onder EMAIL_IMPORT_DIR
+    sources = []
+    for i, doc in enumerate(email_docs):
+        if isinstance(doc, (str, os.PathLike)):
+            sources.append((os.path.basename(os.path.normpath(doc)), resolve_mailbox(str(doc)), True))
+            continue
+        path = os.path.join(directory, f"{i}_{os.path.basename(doc.name)}")
+        with open(path, "wb") as f:
+            f.write(doc.getvalue())
+        sources.append((doc.name, path, False))
+    return sources
+
+
+def iter_raw_messages(name, path, mailbox_only=False):
+    # Eén bericht tegelijk uit een Maildir map, mbox bestand of (alleen bij
+    # uploads) een los .eml bestand
+    if os.path.isdir(path):
+        box = mailbox.Maildir(path, factory=None, create=False)
+        for key in box.iterkeys():
+            yield f"{name}/{key}", box.get_bytes(key)
+    elif path.lower().endswith((".mbox", ".mbx")) or _looks_like_mbox(path):
+        box = mailbox.mbox(path, factory=None, create=False)
+        for i, key in enumerate(box.iterkeys()):
+            yield f"{name}#{i + 1}", box.get_bytes(key)
+    elif mailbox_only:
+        raise ValueError(f"{name} is geen Maildir map of mbox bestand")
+    else:
+        with open(path, "rb") as f:
+            yield name, f.read()
+
+
+def iter_emails(email_docs, max_workers=MAX_WORKERS, batch_size=BATCH_SIZE):
+    directory = tempfile.mkdtemp(prefix="email_ingest_")
+    pool = None
+    try:
+        sources = _spool_uploads(email_docs, directory)
+        messages = (item for name, path, local in sources for item in iter_raw_messages(name, path, local))
+        batches = iter(lambda: list(islice(messages, batch_size)), [])
+
+        seen_ids = set()
+        seen_texts = set()
+
+        def unique(records):
+            for record in records:
+                if record.error is None:
+                    text_key = (record.thread_id, hashlib.sha256(record.text.encode("utf-8")).digest())
+                    if record.message_id in seen_ids or text_key in seen_texts:
+                        continue
+                    seen_texts.add(text_key)
+                seen_ids.add(record.message_id)
+                yield record
+
+        if max_workers <= 1:
+            for batch in batches:
+                yield from unique(_parse_batch(batch))
+            return
+
+        pool = acquire_pool(max_workers)
+        window = max_workers * 2  # begrenst het aantal batches dat tegelijk in het geheugen staat
+        pending = deque()
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                pending.append(pool.apply_async(_parse_batch, (batch,)))
+
+        for _ in range(window):
+            submit_next()
+        while pending:
+            result = pending.popleft()
+            submit_next()
+            yield from unique(result.get())
+    finally:
+        if pool is not None:
+            release_pool(pool)
+        shutil.rmtree(directory, ignore_errors=True)
+
@@ -0,0 +1,141 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+from langchain.schema.embeddings import Embeddings
+
+from openai_client import OpenAIClient, backoff, get_client, retry_after
+from tokens import pack_batches
+from tracing import bind, span
+
+# Verdeelt chunks over batches op basis van tokens en verstuurt meerdere
+# batches tegelijk. Bij een 429 halveert de concurrency en wachten alle
+# workers de Retry-After af; na een reeks successen schaalt hij weer op.
+EMBEDDING_MODEL = "text-embedding-ada-002"
+MAX_BATCH_TOKENS = 20000
+MAX_BATCH_SIZE = 256
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 6
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self.in_flight >= self.limit:
+                    self._cond.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self, rate_limited=False, retry_after=0.0, failed=False):
+        # Een 429 pauzeert alle workers; een serverfout (failed) telt niet als
+        # succes maar halveert alleen de concurrency, de worker wacht zelf
+        with self._cond:
+            self.in_flight -= 1
+            if rate_limited or failed:
+                self.limit = max(1, self.limit // 2)
+                if rate_limited:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class EmbeddingScheduler(Embeddings):
+    # Zelfde endpoint en vectoren als langchain's OpenAIEmbeddings, dus dezelfde cache sleutels
+    cache_namespace = "OpenAIEmbeddings"
+
+    def __init__(self, model=EMBEDDING_MODEL, base_url=None, api_key=None,
+                 max_batch_tokens=MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE,
+                 max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES, progress=None):
+        self.model = model
+        # De retries doet de scheduler zelf (met de limiter), de client levert de connection pool
+        if base_url or api_key:
+            self.client = OpenAIClient(base_url, api_key, max_connections=max_concurrency)
+        else:
+            self.client = get_client()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.progress = progress  # callback(klaar, totaal), wordt vanuit de aanroepende thread gedaan
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.rate_limited = 0
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = [None] * len(texts)
+        batches = pack_batches(texts, self.max_batch_tokens, self.max_batch_size)
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = {
+                pool.submit(bind(self._embed_batch), [texts[i] for i in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                for i, vector in zip(batch, future.result()):
+                    vectors[i] = vector
+                done += len(batch)
+                if self.progress:
+                    self.progress(done, len(texts))
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+    def _embed_batch(self, batch):
+        with span("embeddings", kind="model", model=self.model, items=len(batch)) as current:
+            return self._send_batch(batch, current)
+
+    def _send_batch(self, batch, current):
+        for attempt in range(self.max_retries + 1):
+            current.set(retries=attempt)
+            self.limiter.acquire()
+            try:
+                response = self.client.send("POST", "/embeddings",
+                                            json={"model": self.model, "input": batch})
+            except httpx.TransportError:
+                self.limiter.release()
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(backoff(attempt))
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                wait = retry_after(response, attempt)
+                self.limiter.release(rate_limited=response.status_code == 429, retry_after=wait,
+                                     failed=response.status_code >= 500)
+                if response.status_code == 429:
+                    self.rate_limited += 1
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                if response.status_code >= 500:
+                    time.sleep(wait)
+                continue
+
+            self.limiter.release()
+            response.raise_for_status()
+            usage = response.json().get("usage") or {}
+            current.add(tokens_in=usage.get("prompt_tokens", 0), bytes_out=len(response.content),
+                        bytes_in=int(response.request.headers.get("Content-Length", 0)))
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            return [item["embedding"] for item in data]
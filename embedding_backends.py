@@ -0,0 +1,124 @@
+import atexit
+import hashlib
+import math
+import os
+import re
+import threading
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+from embed_scheduler import EmbeddingScheduler
+from settings import EMBEDDING_BACKEND_LABELS
+
+# Registry van embedding backends die op de Instellingen pagina gekozen kunnen
+# worden. Een index onthoudt met welke backend hij gebouwd is (zie index_store).
+LOCAL_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+HASHING_DIMENSIONS = 384
+
+# Geladen sentence-transformers modellen en hun pools van processen, één per
+# proces in plaats van per sessie of per job
+_models = {}
+_pools = {}
+_models_lock = threading.Lock()
+
+
+def hash_embedding(text, dimensions=1536):
+    # Deterministische bag-of-words vector: gelijke woorden geven gelijke richtingen,
+    # dus similarity search geeft zinnige resultaten zonder model.
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class HashingEmbeddings(Embeddings):
+    # Voor tests en benchmarks: geen netwerk, geen model, altijd dezelfde uitkomst
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+        self.progress = None
+
+    def embed_documents(self, texts):
+        vectors = [hash_embedding(text, self.dimensions) for text in texts]
+        if self.progress:
+            self.progress(len(texts), len(texts))
+        return vectors
+
+    def embed_query(self, text):
+        return hash_embedding(text, self.dimensions)
+
+
+class LocalEmbeddings(Embeddings):
+    # sentence-transformers op de CPU. Kleine aanroepen gaan in één proces (torch
+    # gebruikt dan zelf alle cores); grote batches worden over meerdere processen verdeeld.
+
+    def __init__(self, model_name=LOCAL_MODEL, batch_size=64, workers=None):
+        self.model = model_name
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.progress = None
+        self._model = None
+
+    def _load(self):
+        if self._model is None:
+            with _models_lock:
+                if self.model not in _models:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                    except ImportError as exc:
+                        raise ImportError(
+                            "De lokale embedding backend heeft sentence-transformers nodig: "
+                            "pip install sentence-transformers"
+                        ) from exc
+                    _models[self.model] = SentenceTransformer(self.model, device="cpu")
+                self._model = _models[self.model]
+        return self._model
+
+    def _get_pool(self, model):
+        # (pool, lock): de pool deelt één invoer- en uitvoerqueue, dus twee jobs
+        # mogen er niet tegelijk mee encoden (hij gebruikt toch al alle cores)
+        key = (self.model, self.workers)
+        with _models_lock:
+            if key not in _pools:
+                pool = model.start_multi_process_pool(["cpu"] * self.workers)
+                atexit.register(model.stop_multi_process_pool, pool)
+                _pools[key] = (pool, threading.Lock())
+            return _pools[key]
+
+    def embed_documents(self, texts):
+        model = self._load()
+        texts = list(texts)
+        if self.workers > 1 and len(texts) >= self.batch_size * self.workers:
+            pool, lock = self._get_pool(model)
+            with lock:
+                vectors = model.encode_multi_process(texts, pool, batch_size=self.batch_size)
+        else:
+            vectors = model.encode(texts, batch_size=self.batch_size)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.progress:
+            self.progress(len(texts), len(texts))
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+EMBEDDING_BACKENDS = {
+    "openai": (EMBEDDING_BACKEND_LABELS["openai"], EmbeddingScheduler),
+    "lokaal": (EMBEDDING_BACKEND_LABELS["lokaal"], LocalEmbeddings),
+    "hashing": (EMBEDDING_BACKEND_LABELS["hashing"], HashingEmbeddings),
+}
+DEFAULT_BACKEND = "openai"
+
+
+def get_embeddings(backend=DEFAULT_BACKEND):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Onbekende embedding backend: {backend}")
+    return EMBEDDING_BACKENDS[backend][1]()
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+from array import array
+
+from langchain.schema.embeddings import Embeddings
+
+from sqlite_lru import SqliteLRU
+from tracing import span
+
+# Embeddings worden per (tekst, model) op schijf bewaard, zodat dezelfde PDFs
+# niet telkens opnieuw naar de embeddings API gestuurd worden.
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def cache_key(text, model):
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+
+def embedding_model_name(embeddings):
+    # Het type hoort bij de sleutel: twee backends met dezelfde modelnaam geven
+    # niet per se dezelfde vectoren. Een backend die dezelfde API aanroept als
+    # een eerdere kan diens naam als cache_namespace opgeven. De cache zelf is
+    # geen model: daarvan telt het ingepakte model.
+    while isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+    namespace = getattr(embeddings, "cache_namespace", type(embeddings).__name__)
+    for attr in ("model", "model_name", "repo_id"):
+        name = getattr(embeddings, attr, None)
+        if name:
+            return f"{namespace}:{name}"
+    return namespace
+
+
+class EmbeddingCache(SqliteLRU):
+    # Vectoren staan als float32 blobs in SQLite.
+    table = "embeddings"
+    column = "vector"
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        with self._lock:
+            found = {key: array("f", blob).tolist() for key, blob in self._select(keys).items()}
+            with self._conn:
+                self._touch(found)
+        return found
+
+    def put_many(self, items):
+        rows = [(key, array("f", vector).tobytes()) for key, vector in items]
+        with self._lock:
+            self._insert(rows)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+class CachedEmbeddings(Embeddings):
+    # Wrapper rond een langchain Embeddings object die alleen onbekende chunks laat embedden.
+
+    def __init__(self, embeddings, cache=None):
+        self.embeddings = embeddings
+        self.cache = cache or get_embedding_cache()
+        self.model = embedding_model_name(embeddings)
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        keys = [cache_key(text, self.model) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        # Per unieke chunk: dubbele teksten in één aanroep tellen niet als extra hits
+        hits = len(cached)
+        self.hits += hits
+        self.misses += len(missing)
+
+        with span("embed", items=len(texts), cache_hits=hits, cache_misses=len(missing)):
+            if missing:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+                new_items = list(zip(missing.keys(), vectors))
+                self.cache.put_many(new_items)
+                cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import OrderedDict
+
+from index_store import INDEX_DIR, DocumentIndex, files_lock
+
+# Eén geopende index per (index, documentversie, compressie) voor het hele
+# proces, gedeeld door alle sessies. Sessies bewaren zelf geen index in
+# st.session_state, zodat een uitgezette index ook echt uit het geheugen gaat.
+# Boven POOL_MAX_BYTES laat de pool de minst recent gebruikte indexen los; een
+# sessie die er nog een vasthoudt kan die gewoon afmaken. Uitzetten schrijft
+# niets: alleen opgeslagen indexen komen in de pool, en de gecomprimeerde
+# variant staat ook op schijf, dus het volgende gebruik opent hem opnieuw. Een
+# nieuwe versie van een index (na verwerken of verwijderen) vervangt de oude.
+POOL_MAX_BYTES = int(os.getenv("INDEX_POOL_MAX_BYTES", 2 * 1024 ** 3))
+
+
+class IndexPool:
+
+    def __init__(self, max_bytes=POOL_MAX_BYTES, root=INDEX_DIR):
+        self.max_bytes = max_bytes
+        self.root = root
+        self._entries = OrderedDict()  # (pad, versie, compressie) -> (index, bytes)
+        self._embeddings = {}  # backend -> gedeeld embeddings object
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_embeddings(self, backend):
+        from embedding_backends import get_embeddings
+        from embedding_cache import CachedEmbeddings
+
+        with self._lock:
+            if backend not in self._embeddings:
+                self._embeddings[backend] = CachedEmbeddings(get_embeddings(backend))
+            return self._embeddings[backend]
+
+    def get(self, name, backend, compression="float32"):
+        # Manifest lezen en openen onder files_lock: anders kan een gelijktijdige
+        # save() een nieuwe FAISS index met een oude docstore laten combineren,
+        # en die combinatie zou onder de oude versie in de pool blijven. De lock
+        # zorgt er ook voor dat twee sessies dezelfde index niet dubbel laden.
+        embeddings = self._get_embeddings(backend)
+        with files_lock(name, self.root):
+            index = DocumentIndex(name, embeddings, root=self.root, backend=backend)
+            key = (index.path, index.version(), compression)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+            index.open(compression=compression)
+            size = index.memory_bytes()
+        with self._lock:
+            for other in [other for other in self._entries if other[0] == key[0]]:
+                del self._entries[other]  # een oudere versie of andere compressie van dezelfde index
+            self._entries[key] = (index, size)
+            self.misses += 1
+            self._evict(keep=key)
+        return index
+
+    def _evict(self, keep):
+        used = sum(size for _, size in self._entries.values())
+        for key in list(self._entries):
+            if used <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            used -= self._entries.pop(key)[1]
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "indexes": [
+                    {"name": index.name, "compression": index.compression, "bytes": size,
+                     "vectors": index.vectorstore.index.ntotal if index.vectorstore is not None else 0}
+                    for index, size in self._entries.values()
+                ],
+                "bytes": sum(size for _, size in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_index_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = IndexPool()
+        return _pool
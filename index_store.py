@@ -0,0 +1,374 @@
+import hashlib
+import json
+import math
+import os
+import pickle
+import re
+import shutil
+import threading
+
+# Benoemde FAISS indexen op schijf. Per index bewaren we een manifest met de
+# hash van elk document en de docstore ids van zijn chunks, zodat een
+# ongewijzigde PDF overgeslagen wordt en één document los verwijderd kan worden.
+# faiss, langchain en de BM25 index worden pas geïmporteerd als een index
+# gebruikt wordt; list_indexes (Instellingen pagina) heeft ze niet nodig.
+INDEX_DIR = os.getenv("INDEX_DIR", "indexes")
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+MANIFEST_FILE = "manifest.json"
+BM25_FILE = "bm25.pkl"
+# Chunks per aanroep van de embeddings; groot genoeg dat de scheduler tientallen
+# batches tegelijk kan versturen en de voortgang bij de meeste PDFs niet halverwege
+# opnieuw begint, klein genoeg om een enorm document niet helemaal vast te houden.
+ADD_BATCH_SIZE = 4096
+
+# Gecomprimeerde varianten van index.faiss voor alleen-lezen gebruik (zie
+# index_pool). Ze worden bij het eerste gebruik uit de float32 index gebouwd en
+# naast het origineel bewaard, met de versie van de documenten waar ze bij horen.
+COMPRESSED_FILE = "index.{}.faiss"
+COMPRESSION_FILE = "compression.json"
+COMPRESSIONS = ("float32", "float16", "pq", "ivf")
+PQ_SUBVECTOR_DIMS = 16  # dimensies per PQ code van 8 bits: 1536 floats worden 96 bytes
+PQ_BITS = 8
+IVF_POINTS_PER_LIST = 39  # minimum aantal trainingspunten per cluster (advies van faiss)
+IVF_NPROBE = 16
+# Python objecten (docstore, BM25) nemen in het geheugen ruim meer ruimte in dan gepickled
+OBJECT_OVERHEAD = 3
+
+
+def document_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def list_indexes(root=INDEX_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, MANIFEST_FILE))
+    )
+
+
+def _safe_name(name):
+    name = re.sub(r"[^\w\-]+", "_", name.strip())
+    if not name:
+        raise ValueError("Index naam mag niet leeg zijn")
+    return name
+
+
+class BackendMismatchError(ValueError):
+    pass
+
+
+class UnknownBackendError(BackendMismatchError):
+    # Index van voor de backend keuze: het model staat niet in het manifest
+    pass
+
+
+_index_locks = {}
+_index_locks_lock = threading.Lock()
+
+
+def index_lock(name, root=INDEX_DIR):
+    # Eén schrijver per index binnen het proces (jobs van verschillende gebruikers)
+    key = os.path.join(root, _safe_name(name))
+    with _index_locks_lock:
+        return _index_locks.setdefault(key, threading.Lock())
+
+
+_files_locks = {}
+
+
+def files_lock(name, root=INDEX_DIR):
+    # save() vervangt de bestanden van een index één voor één (het manifest als
+    # laatste); wie ze leest houdt deze lock vast, zodat een nieuwe FAISS index
+    # nooit met een oude docstore samen geladen wordt. Korter dan index_lock,
+    # die een hele verwerking lang vastgehouden wordt.
+    key = os.path.join(root, _safe_name(name))
+    with _index_locks_lock:
+        return _files_locks.setdefault(key, threading.Lock())
+
+
+def confirm_backend(name, embeddings, backend, root=INDEX_DIR):
+    # Legt na bevestiging door de gebruiker de backend vast van een index van
+    # voor de backend keuze
+    with index_lock(name, root):
+        index = DocumentIndex(name, embeddings, root=root, backend=backend, confirm_backend=True)
+        index.save()
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def compress_index(index, mode):
+    # Bouwt een alleen-lezen variant met dezelfde volgorde van vectoren, zodat
+    # index_to_docstore_id blijft kloppen. Geeft (index, gebruikte modus): te
+    # weinig vectoren om PQ of IVF te trainen geeft float16 of float32.
+    import faiss
+
+    if mode == "float32":
+        return index, mode
+    dims, count = index.d, index.ntotal
+    vectors = index.reconstruct_n(0, count) if count else None
+    if mode == "pq" and count >= 2 ** PQ_BITS:
+        subvectors = max(m for m in range(1, dims // PQ_SUBVECTOR_DIMS + 1) if dims % m == 0)
+        compressed = faiss.IndexPQ(dims, subvectors, PQ_BITS, index.metric_type)
+    elif mode == "ivf" and count >= 2 * IVF_POINTS_PER_LIST:
+        lists = max(2, min(int(4 * math.sqrt(count)), count // IVF_POINTS_PER_LIST))
+        quantizer = faiss.IndexFlat(dims, index.metric_type)
+        compressed = faiss.IndexIVFFlat(quantizer, dims, lists, index.metric_type)
+        compressed.nprobe = min(lists, IVF_NPROBE)
+    elif mode == "ivf":
+        return index, "float32"
+    else:
+        mode = "float16"
+        compressed = faiss.IndexScalarQuantizer(dims, faiss.ScalarQuantizer.QT_fp16, index.metric_type)
+    if count:
+        compressed.train(vectors)
+        compressed.add(vectors)
+    return compressed, mode
+
+
+_compress_lock = threading.Lock()
+
+
+class DocumentIndex:
+
+    def __init__(self, name, embeddings, root=INDEX_DIR, backend=None, confirm_backend=False):
+        from bm25 import BM25Index
+        from embedding_cache import embedding_model_name
+
+        self.name = _safe_name(name)
+        self.path = os.path.join(root, self.name)
+        self.embeddings = embeddings
+        self.vectorstore = None
+        self.bm25 = BM25Index()
+        self.mmapped = False
+        self.compression = "float32"
+        self.index_file = os.path.join(self.path, INDEX_FILE)
+        self.manifest = self._load_manifest()
+        self._check_backend(backend, embedding_model_name(embeddings), confirm_backend)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, INDEX_FILE))
+
+    def documents(self):
+        return self.manifest["documents"]
+
+    def has_document(self, doc_hash):
+        return doc_hash in self.manifest["documents"]
+
+    def fingerprint(self):
+        # Identificeert de inhoud van de index: welke documenten, met welk embedding model
+        from embedding_cache import embedding_model_name
+
+        digest = hashlib.sha256(embedding_model_name(self.embeddings).encode("utf-8"))
+        for doc_hash in sorted(self.manifest["documents"]):
+            digest.update(doc_hash.encode("ascii"))
+        return digest.hexdigest()
+
+    def version(self):
+        # Als fingerprint, maar ook de chunk ids tellen mee: hetzelfde document
+        # opnieuw toegevoegd met een andere chunk grootte is een andere index
+        from embedding_cache import embedding_model_name
+
+        content = json.dumps([embedding_model_name(self.embeddings), self.manifest["documents"]], sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def open(self, mmap=True, compression="float32"):
+        # Alleen-lezen openen via mmap geeft een snelle cold start; voor wijzigingen
+        # laden we de index alsnog volledig in het geheugen (zie _ensure_writable).
+        # Een gecomprimeerde index is altijd alleen-lezen.
+        if self.vectorstore is not None or not self.exists():
+            return self.vectorstore
+        import faiss
+        from langchain.vectorstores import FAISS
+
+        index_path = self._compressed_path(compression) if compression != "float32" else self.index_file
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self.mmapped = True
+            except RuntimeError:
+                index = None
+        if index is None:
+            index = faiss.read_index(index_path)
+            self.mmapped = False
+        with open(os.path.join(self.path, DOCSTORE_FILE), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        self.vectorstore = FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+        self.bm25 = self._load_bm25()
+        self.index_file = index_path
+        return self.vectorstore
+
+    def _compressed_path(self, compression):
+        import faiss
+
+        path = os.path.join(self.path, COMPRESSED_FILE.format(compression))
+        info_path = os.path.join(self.path, COMPRESSION_FILE)
+        version = self.version()
+        with _compress_lock:
+            info = {}
+            if os.path.exists(info_path):
+                with open(info_path) as f:
+                    info = json.load(f)
+            built = info.get(compression, {})
+            if built.get("version") != version or (built["mode"] != "float32" and not os.path.exists(path)):
+                compressed, mode = compress_index(faiss.read_index(self.index_file), compression)
+                if mode != "float32":
+                    _write_atomic(path, lambda tmp: faiss.write_index(compressed, tmp))
+                info[compression] = built = {"version": version, "mode": mode}
+
+                def write_info(tmp):
+                    with open(tmp, "w") as f:
+                        json.dump(info, f, indent=2)
+
+                _write_atomic(info_path, write_info)
+        self.compression = built["mode"]
+        # Te klein om te comprimeren: dan gewoon het origineel
+        return path if built["mode"] != "float32" else self.index_file
+
+    def memory_bytes(self):
+        # Schatting voor het budget van de index pool: de faiss index zoals hij op
+        # schijf staat, plus docstore en BM25 met de overhead van Python objecten
+        if self.vectorstore is None:
+            return 0
+        size = os.path.getsize(self.index_file)
+        for name in (DOCSTORE_FILE, BM25_FILE):
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                size += os.path.getsize(path) * OBJECT_OVERHEAD
+        return size
+
+    def add_document(self, doc_hash, file_name, chunks, batch_size=ADD_BATCH_SIZE):
+        # chunks mag een generator zijn; we embedden per batch zodat een groot
+        # document niet in zijn geheel in het geheugen hoeft te staan.
+        if self.has_document(doc_hash):
+            return False
+        ids = []
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                ids.extend(self._add_batch(doc_hash, file_name, batch, len(ids)))
+                batch = []
+        if batch:
+            ids.extend(self._add_batch(doc_hash, file_name, batch, len(ids)))
+        self.manifest["documents"][doc_hash] = {"file": file_name, "ids": ids}
+        return True
+
+    def _add_batch(self, doc_hash, file_name, chunks, first_id):
+        texts = [chunk.text for chunk in chunks]
+        metadatas = [dict(chunk.metadata, source=file_name, doc_hash=doc_hash) for chunk in chunks]
+        ids = [f"{doc_hash}:{first_id + i}" for i in range(len(chunks))]
+        self._ensure_writable()
+        if self.vectorstore is None:
+            from langchain.vectorstores import FAISS
+            self.vectorstore = FAISS.from_texts(
+                texts=texts, embedding=self.embeddings, metadatas=metadatas, ids=ids
+            )
+        else:
+            self.vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+        for doc_id, text in zip(ids, texts):
+            self.bm25.add(doc_id, text)
+        return ids
+
+    def remove_document(self, doc_hash):
+        entry = self.manifest["documents"].pop(doc_hash, None)
+        if entry is None:
+            return False
+        if entry["ids"]:
+            self._ensure_writable()
+            self.vectorstore.delete(entry["ids"])
+            self.bm25.remove_many(entry["ids"])
+        return True
+
+    def save(self):
+        with files_lock(self.name, os.path.dirname(self.path)):
+            os.makedirs(self.path, exist_ok=True)
+            if self.vectorstore is not None and not self.mmapped:
+                import faiss
+                _write_atomic(
+                    os.path.join(self.path, INDEX_FILE),
+                    lambda tmp: faiss.write_index(self.vectorstore.index, tmp),
+                )
+
+                def write_docstore(tmp):
+                    with open(tmp, "wb") as f:
+                        pickle.dump((self.vectorstore.docstore, self.vectorstore.index_to_docstore_id), f)
+
+                _write_atomic(os.path.join(self.path, DOCSTORE_FILE), write_docstore)
+
+                def write_bm25(tmp):
+                    with open(tmp, "wb") as f:
+                        pickle.dump(self.bm25, f)
+
+                _write_atomic(os.path.join(self.path, BM25_FILE), write_bm25)
+
+            def write_manifest(tmp):
+                with open(tmp, "w") as f:
+                    json.dump(self.manifest, f, indent=2)
+
+            _write_atomic(os.path.join(self.path, MANIFEST_FILE), write_manifest)
+
+    def delete(self):
+        from bm25 import BM25Index
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.vectorstore = None
+        self.bm25 = BM25Index()
+        self.manifest = {"documents": {}}
+
+    def _ensure_writable(self):
+        if self.compression != "float32":
+            raise ValueError(f"Index '{self.name}' is gecomprimeerd ({self.compression}) en alleen-lezen")
+        if self.vectorstore is None and self.exists():
+            self.open(mmap=False)
+        elif self.mmapped:
+            self.vectorstore = None
+            self.open(mmap=False)
+
+    def _load_bm25(self):
+        bm25_path = os.path.join(self.path, BM25_FILE)
+        if os.path.exists(bm25_path):
+            with open(bm25_path, "rb") as f:
+                return pickle.load(f)
+        # Index van voor de BM25 ondersteuning: opbouwen uit de docstore
+        from bm25 import BM25Index
+        bm25 = BM25Index()
+        for doc_id in self.vectorstore.index_to_docstore_id.values():
+            bm25.add(doc_id, self.vectorstore.docstore.search(doc_id).page_content)
+        return bm25
+
+    def _check_backend(self, backend, model, confirm=False):
+        # Vectoren van een ander model zijn niet vergelijkbaar; zoeken zou dan
+        # stilletjes onzin opleveren, dus weigeren we de index te openen. Bij een
+        # index zonder model in het manifest moet de gebruiker bevestigen met welke
+        # backend hij gebouwd is (confirm) voordat we dat vastleggen.
+        built_with = self.manifest.get("embedding_backend"), self.manifest.get("embedding_model")
+        if self.manifest["documents"] and built_with[1] is None and not confirm:
+            raise UnknownBackendError(
+                f"Van index '{self.name}' is niet bekend met welk embedding model hij gebouwd is"
+            )
+        if built_with[0] == backend and built_with[1] in (model.split(":", 1)[-1], f"CachedEmbeddings:{model}"):
+            # Manifest met de modelnaam zonder type ervoor (de backend legt het type al
+            # vast) of met de cache wrapper ervoor; beide zijn hetzelfde model
+            built_with = (backend, model)
+        if self.manifest["documents"] and built_with[1] is not None and built_with != (backend, model):
+            raise BackendMismatchError(
+                f"Index '{self.name}' is gebouwd met {built_with[0]} ({built_with[1]}), "
+                f"niet met {backend} ({model})"
+            )
+        self.manifest["embedding_backend"] = backend
+        self.manifest["embedding_model"] = model
+
+    def _load_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                return json.load(f)
+        return {"documents": {}}
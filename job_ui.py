@@ -0,0 +1,68 @@
+import time
+import uuid
+
+import streamlit as st
+
+from jobs import CANCELLED, DONE, FAILED, FINISHED, INTERRUPTED, get_job_runner
+
+# Streamlit kant van de job queue: wie is de gebruiker, en het volgen van een
+# job tot hij klaar is. Een rerun onderbreekt alleen het volgen; de job loopt
+# door en de pagina haakt bij de volgende run weer aan.
+POLL_INTERVAL = 0.5
+
+
+def session_user():
+    # Het gebruikers id staat in de URL, zodat een reconnect (of een nieuwe tab
+    # met dezelfde link) dezelfde jobs terugvindt
+    params = st.experimental_get_query_params()
+    user = (params.get("gebruiker") or [None])[0] or st.session_state.get("user_id") or uuid.uuid4().hex[:12]
+    st.session_state.user_id = user
+    if params.get("gebruiker") != [user]:
+        params["gebruiker"] = [user]
+        st.experimental_set_query_params(**params)
+    return user
+
+
+def latest_job(kind):
+    return get_job_runner().latest(session_user(), kind)
+
+
+def submit_job(kind, fn, *args, **kwargs):
+    return get_job_runner().submit(session_user(), kind, fn, *args, **kwargs)
+
+
+def follow_job(job_id, on_update=None):
+    # Toont voortgang tot de job afgerond is; on_update(job) krijgt bij elke poll de
+    # laatste stand, zodat de pagina tussenresultaten kan tonen
+    runner = get_job_runner()
+    job = runner.get(job_id)
+    if job["status"] not in FINISHED and st.button("Annuleren", key=f"annuleer_{job_id}"):
+        runner.cancel(job_id)
+    status = st.empty()
+    bar = st.empty()
+    while True:
+        job = runner.get(job_id)
+        if on_update:
+            on_update(job)
+        if job["status"] in FINISHED:
+            break
+        stage = job["stage"] or job["status"]
+        if job["total"]:
+            status.caption(f"{stage}: {job['done']}/{job['total']}")
+            bar.progress(min(1.0, job["done"] / job["total"]))
+        else:
+            status.caption(f"{stage}...")
+        time.sleep(POLL_INTERVAL)
+    status.empty()
+    bar.empty()
+    if job["status"] == FAILED:
+        st.error(f"De job is mislukt: {job['error']}")
+    elif job["status"] == CANCELLED:
+        st.warning("De job is geannuleerd.")
+    elif job["status"] == INTERRUPTED:
+        st.warning("De job is onderbroken doordat de server herstartte. Start hem opnieuw.")
+    return job
+
+
+def job_done(job):
+    return job is not None and job["status"] == DONE
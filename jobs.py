@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import bind
+
+# Lokale job queue voor lange pipelines (PDFs verwerken, shownotes, email
+# podcast). Jobs draaien in een worker pool buiten de Streamlit script thread,
+# zodat een rerun of een gesloten tab het werk niet weggooit. Status, voortgang
+# per stap en (tussen)resultaten staan in SQLite; de pagina pollt en kan na een
+# rerun of reconnect opnieuw aanhaken. Per gebruiker draaien maximaal
+# MAX_JOBS_PER_USER jobs tegelijk, de rest wacht in de rij.
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(".cache", "jobs.sqlite3"))
+MAX_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+MAX_JOBS_PER_USER = int(os.getenv("JOBS_PER_USER", 1))
+JOB_RETENTION = 7 * 24 * 3600  # afgeronde jobs worden daarna opgeruimd
+
+QUEUED = "wachtrij"
+RUNNING = "bezig"
+DONE = "klaar"
+FAILED = "mislukt"
+CANCELLED = "geannuleerd"
+INTERRUPTED = "onderbroken"  # het proces stopte terwijl de job liep
+FINISHED = {DONE, FAILED, CANCELLED, INTERRUPTED}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # Wordt aan de job functie meegegeven om voortgang en tussenresultaten te melden
+
+    def __init__(self, runner, job_id, user, kind):
+        self.runner = runner
+        self.id = job_id
+        self.user = user
+        self.kind = kind
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, stage, done=0, total=0):
+        self.check()
+        self.runner._update(self.id, stage=stage, done=done, total=total)
+
+    def publish(self, **partial):
+        # Tussenresultaten die de pagina al kan tonen terwijl de job nog loopt
+        self.runner._merge_result(self.id, partial)
+
+
+class JobRunner:
+
+    def __init__(self, path=JOBS_PATH, max_workers=MAX_WORKERS, max_per_user=MAX_JOBS_PER_USER):
+        self.path = path
+        self.max_per_user = max_per_user
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._pending = deque()  # (job, fn, args, kwargs)
+        self._running = {}  # user -> aantal lopende jobs
+        self._jobs = {}  # job id -> Job, zolang de job wacht of loopt
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, user TEXT NOT NULL, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "stage TEXT NOT NULL DEFAULT '', done INTEGER NOT NULL DEFAULT 0, "
+                "total INTEGER NOT NULL DEFAULT 0, result TEXT NOT NULL DEFAULT '{}', "
+                "error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, kind, created)")
+            # Jobs van een vorig proces komen niet meer terug
+            self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE status IN (?, ?)",
+                               (INTERRUPTED, time.time(), QUEUED, RUNNING))
+            self._conn.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - JOB_RETENTION,))
+
+    def submit(self, user, kind, fn, *args, **kwargs):
+        # fn(job, *args, **kwargs) draait in een worker thread; zijn return waarde
+        # (een dict met JSON waarden) wordt aan het resultaat toegevoegd
+        job = Job(self, uuid.uuid4().hex, user, kind)
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, user, kind, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job.id, user, kind, QUEUED, now, now),
+                )
+            self._jobs[job.id] = job
+            # De job draait in een worker thread maar telt in de traces mee voor de pagina die hem startte
+            self._pending.append((job, bind(fn), args, kwargs))
+            self._dispatch()
+        return job.id
+
+    def _dispatch(self):
+        # Start wachtende jobs in volgorde van aankomst, zolang hun gebruiker onder de limiet zit
+        for item in list(self._pending):
+            job = item[0]
+            if self._running.get(job.user, 0) >= self.max_per_user:
+                continue
+            self._pending.remove(item)
+            self._running[job.user] = self._running.get(job.user, 0) + 1
+            self._set(job.id, status=RUNNING)
+            self._executor.submit(self._run, *item)
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            result = fn(job, *args, **kwargs)
+            job.check()
+            self._merge_result(job.id, result or {})
+            self._update(job.id, status=DONE)
+        except JobCancelled:
+            self._update(job.id, status=CANCELLED)
+        except Exception as exc:
+            traceback.print_exc()
+            self._update(job.id, status=FAILED, error=str(exc) or type(exc).__name__)
+        finally:
+            with self._lock:
+                self._running[job.user] -= 1
+                self._jobs.pop(job.id, None)
+                self._dispatch()
+
+    def _set(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._set(job_id, **fields)
+
+    def _merge_result(self, job_id, partial):
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            result = json.loads(row[0]) if row else {}
+            result.update(partial)
+            self._set(job_id, result=json.dumps(result))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, user, kind, status, stage, done, total, result, error, created, updated "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "user", "kind", "status", "stage", "done", "total", "result", "error", "created", "updated")
+        job = dict(zip(keys, row))
+        job["result"] = json.loads(job["result"])
+        return job
+
+    def latest(self, user, kind):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE user = ? AND kind = ? ORDER BY created DESC LIMIT 1", (user, kind)
+            ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancel_event.set()
+            for item in list(self._pending):
+                if item[0] is job:
+                    # Nog niet gestart: direct uit de rij
+                    self._pending.remove(item)
+                    self._jobs.pop(job_id, None)
+                    self._set(job_id, status=CANCELLED)
+            return True
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
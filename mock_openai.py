@@ -0,0 +1,215 @@
+import argparse
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from embedding_backends import hash_embedding
+
+# Lokale stand-in voor de OpenAI API (embeddings, chat met en zonder streaming,
+# transcriptie en spraak), om de pipelines zonder API key en zonder
+# kosten te kunnen testen en benchmarken. Start met:
+#   python mock_openai.py --port 8765 --latency 0.2 --max-concurrent 4
+# en zet OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, max_concurrent=0, retry_after=1.0, dimensions=1536):
+        super().__init__(address, MockOpenAIHandler)
+        self.latency = latency
+        self.max_concurrent = max_concurrent  # 0 = onbeperkt; daarboven volgt een 429
+        self.retry_after = retry_after
+        self.dimensions = dimensions
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        with server.lock:
+            server.requests += 1
+            if server.max_concurrent and server.in_flight >= server.max_concurrent:
+                server.rate_limited += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached"}},
+                                {"Retry-After": str(server.retry_after)})
+                return
+            server.in_flight += 1
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            handler = ROUTES.get(self.path.split("?")[0])
+            if handler is None:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            handler(self, _parse_body(self.headers.get("Content-Type", ""), body))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events):
+        # Server-sent events zoals de streaming API ze stuurt
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events + ["[DONE]"]:
+            data = f"data: {event if isinstance(event, str) else json.dumps(event)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _parse_body(content_type, body):
+    if not content_type.startswith("multipart/form-data"):
+        return json.loads(body or b"{}")
+    # Formulier met bestanden (audio/transcriptions): velden als tekst, bestanden als bytes
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    payload = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if part.get_filename():
+            payload[name] = part.get_payload(decode=True)
+        else:
+            payload[name] = part.get_content().strip()
+    return payload
+
+
+def _embeddings(handler, payload):
+    inputs = payload.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimensions = handler.server.dimensions
+    handler._send_json(200, {
+        "object": "list",
+        "model": payload.get("model"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": hash_embedding(text, dimensions)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": sum(len(text.split()) for text in inputs),
+                  "total_tokens": sum(len(text.split()) for text in inputs)},
+    })
+
+
+def _chat_completions(handler, payload):
+    # Deterministisch antwoord: een echo van het begin van het laatste bericht
+    question = payload.get("messages", [{}])[-1].get("content", "")
+    content = f"Mock antwoord op: {' '.join(question.split()[:30])}"
+    if (payload.get("response_format") or {}).get("type") == "json_object":
+        # JSON modus (gebatchte samenvattingen): één string per "### Email" sectie
+        sections = question.split("### Email")[1:] or [question]
+        content = json.dumps({"summaries": [f"Mock samenvatting: {' '.join(s.split()[:12])}" for s in sections]})
+    model = payload.get("model")
+    if payload.get("stream"):
+        words = content.split(" ")
+        handler._send_events([
+            {"object": "chat.completion.chunk", "model": model,
+             "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]}
+            for i, word in enumerate(words)
+        ] + [{"object": "chat.completion.chunk", "model": model,
+              "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}])
+        return
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+    handler._send_json(200, {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content.split()),
+                  "total_tokens": prompt_tokens + len(content.split())},
+    })
+
+
+def _transcriptions(handler, payload):
+    # Duur geschat uit de bestandsgrootte bij 128 kbit/s, met een segment per 10 seconden
+    duration = max(1.0, len(payload.get("file", b"")) / 16000)
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(duration, start + 10.0)
+        segments.append({"id": len(segments), "start": start, "end": end,
+                         "text": f" Mock transcript segment {len(segments) + 1}."})
+        start = end
+    handler._send_json(200, {
+        "task": "transcribe",
+        "language": payload.get("language", "nl"),
+        "duration": duration,
+        "text": "".join(segment["text"] for segment in segments).strip(),
+        "segments": segments,
+    })
+
+
+# Stil MPEG-1 layer III frame (128 kbit/s, 44.1 kHz, 26 ms); geldige MP3 om aan elkaar te plakken
+SILENT_MP3_FRAME = bytes.fromhex("fffb9064") + bytes(413)
+
+
+def _speech(handler, payload):
+    # Ongeveer 15 tekens per seconde gesproken tekst
+    frames = max(1, int(len(payload.get("input", "")) / 15 / 0.026))
+    handler._send_bytes(200, SILENT_MP3_FRAME * frames, "audio/mpeg")
+
+
+ROUTES = {
+    "/v1/embeddings": _embeddings,
+    "/v1/chat/completions": _chat_completions,
+    "/v1/audio/transcriptions": _transcriptions,
+    "/v1/audio/speech": _speech,
+}
+
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    server = MockOpenAIServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokale stand-in voor de OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconden per request")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="429 boven dit aantal gelijktijdige requests")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    server = MockOpenAIServer((args.host, args.port), latency=args.latency,
+                              max_concurrent=args.max_concurrent, retry_after=args.retry_after)
+    print(f"Mock OpenAI API op {server.base_url}")
+    server.serve_forever()
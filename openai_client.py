@@ -0,0 +1,252 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+import httpx
+import numpy as np
+
+from tracing import current_span, span
+
+# Eén gedeelde client voor alle OpenAI aanroepen: een connection pool met
+# keep-alive, een sync en een async API, retries met jitter die Retry-After
+# volgen, een deadline per aanroep en latency metingen per endpoint. Elke
+# aanroep is een "model" span (zie tracing) met tokens, bytes en retries. Met
+# OPENAI_BASE_URL kan alles naar de lokale stand-in (mock_openai.py).
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+TIMEOUT = 60.0  # per poging
+DEADLINE = 300.0  # voor de hele aanroep, inclusief retries
+MAX_RETRIES = 4
+MAX_CONNECTIONS = 16
+METRICS_WINDOW = 500  # metingen per endpoint
+
+
+class OpenAIError(RuntimeError):
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def backoff(attempt):
+    return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def retry_after(response, attempt):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return backoff(attempt)
+
+
+def _retryable(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def _error(response):
+    try:
+        message = response.json()["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        message = response.text[:200]
+    return OpenAIError(f"OpenAI {response.request.url.path} gaf {response.status_code}: {message}",
+                       response.status_code)
+
+
+def _annotate(response, attempt):
+    # Bytes en retries op de span van de lopende aanroep (chat, transcriptie, ...)
+    current = current_span()
+    if current is not None and current.kind == "model":
+        current.add(bytes_in=int(response.request.headers.get("Content-Length", 0)),
+                    bytes_out=len(response.content), retries=attempt)
+
+
+def _usage(response):
+    usage = response.json().get("usage") or {}
+    return {"tokens_in": usage.get("prompt_tokens", 0), "tokens_out": usage.get("completion_tokens", 0)}
+
+
+class LatencyMetrics:
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok=True):
+        with self._lock:
+            self._durations[endpoint].append(seconds)
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def summary(self):
+        with self._lock:
+            snapshot = {endpoint: list(durations) for endpoint, durations in self._durations.items()}
+            errors = dict(self._errors)
+        return {
+            endpoint: {
+                "calls": len(durations),
+                "errors": errors.get(endpoint, 0),
+                "p50": float(np.percentile(durations, 50)),
+                "p95": float(np.percentile(durations, 95)),
+            }
+            for endpoint, durations in snapshot.items()
+        }
+
+
+class OpenAIClient:
+
+    def __init__(self, base_url=None, api_key=None, timeout=TIMEOUT, deadline=DEADLINE,
+                 max_retries=MAX_RETRIES, max_connections=MAX_CONNECTIONS):
+        self.base_url = (base_url or OPENAI_BASE_URL).rstrip("/")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.metrics = LatencyMetrics()
+        self.http = httpx.Client(base_url=self.base_url, headers=self._headers(),
+                                 limits=self.limits, timeout=timeout)
+        # Een AsyncClient hoort bij één event loop, dus er is er één per loop
+        self._async_clients = {}
+        self._lock = threading.Lock()
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _async_http(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(base_url=self.base_url, headers=self._headers(),
+                                           limits=self.limits, timeout=self.timeout)
+                self._async_clients[loop] = client
+            return client
+
+    def _timeout(self, deadline_at, path):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise OpenAIError(f"Deadline verstreken voor {path}")
+        return min(self.timeout, remaining)
+
+    def send(self, method, path, deadline_at=None, **kwargs):
+        # Eén poging zonder retries; voor aanroepers met een eigen retry strategie
+        timeout = self._timeout(deadline_at or time.monotonic() + self.deadline, path)
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, path, timeout=timeout, **kwargs)
+        except httpx.TransportError:
+            self.metrics.record(path, time.perf_counter() - started, ok=False)
+            raise
+        self.metrics.record(path, time.perf_counter() - started, ok=response.status_code < 400)
+        return response
+
+    async def asend(self, method, path, deadline_at=None, **kwargs):
+        timeout = self._timeout(deadline_at or time.monotonic() + self.deadline, path)
+        started = time.perf_counter()
+        try:
+            response = await self._async_http().request(method, path, timeout=timeout, **kwargs)
+        except httpx.TransportError:
+            self.metrics.record(path, time.perf_counter() - started, ok=False)
+            raise
+        self.metrics.record(path, time.perf_counter() - started, ok=response.status_code < 400)
+        return response
+
+    def request(self, method, path, deadline=None, **kwargs):
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.send(method, path, deadline_at, **kwargs)
+            except httpx.TransportError as exc:
+                wait = backoff(attempt)
+                if attempt == self.max_retries or time.monotonic() + wait >= deadline_at:
+                    raise OpenAIError(f"Verbinding met OpenAI mislukt voor {path}: {exc}") from exc
+                time.sleep(wait)
+                continue
+            if _retryable(response) and attempt < self.max_retries:
+                wait = retry_after(response, attempt)
+                if time.monotonic() + wait < deadline_at:
+                    time.sleep(wait)
+                    continue
+            if response.status_code >= 400:
+                raise _error(response)
+            _annotate(response, attempt)
+            return response
+
+    async def arequest(self, method, path, deadline=None, **kwargs):
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.asend(method, path, deadline_at, **kwargs)
+            except httpx.TransportError as exc:
+                wait = backoff(attempt)
+                if attempt == self.max_retries or time.monotonic() + wait >= deadline_at:
+                    raise OpenAIError(f"Verbinding met OpenAI mislukt voor {path}: {exc}") from exc
+                await asyncio.sleep(wait)
+                continue
+            if _retryable(response) and attempt < self.max_retries:
+                wait = retry_after(response, attempt)
+                if time.monotonic() + wait < deadline_at:
+                    await asyncio.sleep(wait)
+                    continue
+            if response.status_code >= 400:
+                raise _error(response)
+            _annotate(response, attempt)
+            return response
+
+    def chat(self, messages, model="gpt-3.5-turbo", deadline=None, **params):
+        with span("chat", kind="model", model=model) as current:
+            response = self.request("POST", "/chat/completions", deadline,
+                                    json={"model": model, "messages": messages, **params})
+            current.add(**_usage(response))
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def achat(self, messages, model="gpt-3.5-turbo", deadline=None, **params):
+        with span("chat", kind="model", model=model) as current:
+            response = await self.arequest("POST", "/chat/completions", deadline,
+                                           json={"model": model, "messages": messages, **params})
+            current.add(**_usage(response))
+        return response.json()["choices"][0]["message"]["content"]
+
+    def transcribe(self, path, model="whisper-1", deadline=None, **params):
+        # Het bestand wordt als bytes meegestuurd, zodat een retry dezelfde inhoud verstuurt
+        with open(path, "rb") as f:
+            content = f.read()
+        files = {"file": (os.path.basename(path), content, "audio/mpeg")}
+        with span("transcription", kind="model", model=model) as current:
+            response = self.request("POST", "/audio/transcriptions", deadline,
+                                    data={"model": model, **params}, files=files)
+            result = response.json()
+            current.add(audio_seconds=result.get("duration", 0) if isinstance(result, dict) else 0)
+        return result
+
+    def speech(self, text, voice="alloy", model="tts-1", response_format="mp3", deadline=None):
+        with span("speech", kind="model", model=model, characters=len(text)):
+            response = self.request("POST", "/audio/speech", deadline, json={
+                "model": model, "voice": voice, "input": text, "response_format": response_format})
+        return response.content
+
+    async def aspeech(self, text, voice="alloy", model="tts-1", response_format="mp3", deadline=None):
+        with span("speech", kind="model", model=model, characters=len(text)):
+            response = await self.arequest("POST", "/audio/speech", deadline, json={
+                "model": model, "voice": voice, "input": text, "response_format": response_format})
+        return response.content
+
+    def close(self):
+        self.http.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAIClient()
+        return _client
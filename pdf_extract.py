@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from PyPDF2 import PdfReader
+
+from process_pool import acquire_pool, release_pool
+
+# Pagina's worden verdeeld over een pool van processen en in paginavolgorde
+# teruggegeven zodra ze klaar zijn, zonder alle tekst in één string te bouwen.
+PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", 30))
+MAX_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+
+
+@dataclass
+class PageText:
+    file: str
+    page: int  # 1-based, zoals de gebruiker het paginanummer ziet
+    text: str
+    start: int  # char offset binnen de tekst van dit bestand
+    end: int
+    error: Optional[str] = None
+
+
+# Per worker proces houden we de laatst geopende PDFs vast, zodat niet elke
+# pagina het bestand opnieuw hoeft te parsen.
+_readers = {}
+
+
+def _extract_page(path, page_index):
+    reader = _readers.get(path)
+    if reader is None:
+        if len(_readers) >= 4:
+            _readers.clear()
+        reader = PdfReader(path)
+        _readers[path] = reader
+    return reader.pages[page_index].extract_text() or ""
+
+
+def _spool_uploads(pdf_docs, directory):
+    files = []
+    for i, pdf in enumerate(pdf_docs):
+        if isinstance(pdf, (str, os.PathLike)):
+            files.append((os.path.basename(pdf), str(pdf)))
+            continue
+        path = os.path.join(directory, f"{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(pdf.getvalue())
+        files.append((pdf.name, path))
+    return files
+
+
+def iter_pdf_pages(pdf_docs, max_workers=MAX_WORKERS, page_timeout=PAGE_TIMEOUT):
+    directory = tempfile.mkdtemp(prefix="pdf_extract_")
+    timed_out = False
+    pool = None
+    try:
+        files = _spool_uploads(pdf_docs, directory)
+        tasks = (
+            (file_index, file_name, path, page_index)
+            for file_index, (file_name, path) in enumerate(files)
+            for page_index in range(len(PdfReader(path).pages))
+        )
+
+        if max_workers <= 1:
+            offsets = {}
+            for file_index, file_name, path, page_index in tasks:
+                try:
+                    text, error = _extract_page(path, page_index), None
+                except Exception as exc:
+                    text, error = "", str(exc) or type(exc).__name__
+                yield _page_result(offsets, file_index, file_name, page_index, text, error)
+            return
+
+        pool = acquire_pool(max_workers)
+        window = max_workers * 4  # begrenst het aantal pagina's dat tegelijk in het geheugen staat
+        pending = deque()
+        offsets = {}
+
+        def submit_next():
+            task = next(tasks, None)
+            if task is not None:
+                file_index, file_name, path, page_index = task
+                result = pool.apply_async(_extract_page, (path, page_index))
+                pending.append((file_index, file_name, page_index, result))
+
+        for _ in range(window):
+            submit_next()
+        while pending:
+            file_index, file_name, page_index, result = pending.popleft()
+            submit_next()
+            try:
+                text, error = result.get(timeout=page_timeout), None
+            except multiprocessing.TimeoutError:
+                text, error = "", "timeout"
+                timed_out = True
+            except Exception as exc:  # PyPDF2 faalt op sommige kapotte pagina's
+                text, error = "", str(exc) or type(exc).__name__
+            yield _page_result(offsets, file_index, file_name, page_index, text, error)
+    finally:
+        if pool is not None:
+            release_pool(pool, broken=timed_out)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _page_result(offsets, file_index, file_name, page_index, text, error=None):
+    start = offsets.get(file_index, 0)
+    end = start + len(text)
+    offsets[file_index] = end
+    return PageText(file=file_name, page=page_index + 1, text=text, start=start, end=end, error=error)
@@ -0,0 +1,34 @@
+import multiprocessing
+import threading
+
+# Eén gedeelde spawn pool voor het CPU-werk van de ingest (PDF pagina's, mails
+# parsen), zodat er niet per module een eigen set worker processen blijft
+# draaien. De eerste aanvraag bepaalt het aantal workers.
+_pool = None
+_pool_users = {}  # pool -> aantal lopende iteraties dat hem gebruikt
+_pool_lock = threading.Lock()
+
+
+def acquire_pool(max_workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn in plaats van fork: de Streamlit server draait met meerdere threads
+            _pool = multiprocessing.get_context("spawn").Pool(max_workers)
+            _pool_users[_pool] = 0
+        _pool_users[_pool] += 1
+        return _pool
+
+
+def release_pool(pool, broken=False):
+    # Een taak die zijn timeout overschreed houdt zijn worker bezet; zo'n pool
+    # krijgen nieuwe aanroepen niet meer, en hij wordt afgebroken zodra de
+    # laatste iteratie (ook die van andere sessies) ermee klaar is.
+    global _pool
+    with _pool_lock:
+        if broken and _pool is pool:
+            _pool = None
+        _pool_users[pool] -= 1
+        if _pool_users[pool] == 0 and pool is not _pool:
+            del _pool_users[pool]
+            pool.terminate()
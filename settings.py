@@ -0,0 +1,43 @@
+import json
+import os
+import uuid
+
+# App-brede instellingen die op de Instellingen pagina aangepast worden en
+# voor alle sessies gelden.
+SETTINGS_PATH = os.getenv("SETTINGS_PATH", "settings.json")
+DEFAULTS = {
+    "embedding_backend": "openai",
+    "index_compression": "float32",
+}
+
+# Namen van de embedding backends (zie embedding_backends), hier zodat de
+# Instellingen pagina ze kan tonen zonder langchain en de modellen te laden
+EMBEDDING_BACKEND_LABELS = {
+    "openai": "OpenAI (text-embedding-ada-002)",
+    "lokaal": "Lokaal op de CPU (sentence-transformers)",
+    "hashing": "Hashing vectoren (tests en benchmarks)",
+}
+
+# Hoe de gedeelde indexen in het geheugen staan (zie index_store.compress_index)
+INDEX_COMPRESSION_LABELS = {
+    "float32": "Geen compressie (float32, exact)",
+    "float16": "float16 (half zo groot, vrijwel exact)",
+    "pq": "Product quantization (~64x kleiner, benaderend)",
+    "ivf": "IVF clusters (sneller zoeken in grote corpora, benaderend)",
+}
+
+
+def load_settings():
+    settings = dict(DEFAULTS)
+    if os.path.exists(SETTINGS_PATH):
+        with open(SETTINGS_PATH) as f:
+            settings.update(json.load(f))
+    return settings
+
+
+def save_settings(settings):
+    # Uniek per aanroep: twee sessies kunnen tegelijk opslaan
+    tmp_path = f"{SETTINGS_PATH}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(settings, f, indent=2)
+    os.replace(tmp_path, SETTINGS_PATH)
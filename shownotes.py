@@ -1,57 +1,86 @@
 import streamlit as st
-from pydub import AudioSegment
 from io import BytesIO
+import json
 import os
-import requests
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
 from dotenv import load_dotenv
+from disk_cache import get_cached, put_cached
+from audio_segmenter import segment_audio, spool_to_disk
+from openai_client import OpenAIError, get_client
+from tokens import count_tokens
+from job_ui import follow_job, job_done, latest_job, submit_job
+from jobs import FINISHED, get_job_runner
+from tracing import bind, set_page, span
 
 # Laad de OpenAI API key uit .env
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Verzeker dat de podcast_parts map bestaat
 podcast_parts_dir = "podcast_parts"
 os.makedirs(podcast_parts_dir, exist_ok=True)
 
+# Aantal segmenten dat tegelijk naar Whisper en GPT-4 gaat. Retries en timeouts
+# doet de gedeelde client (openai_client).
+MAX_WORKERS = 4
+
+WHISPER_MODEL = "whisper-1"
+SHOWNOTES_MODEL = "gpt-4"
+
+@dataclass
+class AudioChunk:
+    path: str
+    start_ms: int
+    end_ms: int
+    audio_hash: str
+
+
 def split_and_save_audio(audio_file, chunk_length_ms=300000):  # 300000ms = 5 minuten
-    audio = AudioSegment.from_file(audio_file)
-    original_filename = os.path.splitext(os.path.basename(audio_file.name))[0]
-    
-    chunk_paths = []
-    for i, start in enumerate(range(0, len(audio), chunk_length_ms), start=1):
-        end = start + chunk_length_ms if start + chunk_length_ms < len(audio) else len(audio)
-        chunk = audio[start:end]
-        
-        part_filename = f"{original_filename}_part_{i}.mp3"
-        part_path = os.path.join(podcast_parts_dir, part_filename)
-        chunk.export(part_path, format="mp3")
-        
-        chunk_paths.append(part_path)
-    return chunk_paths
+    # Onderdelen staan in een map per content hash: een rerun of een tweede upload
+    # van dezelfde aflevering hoeft niet opnieuw te splitsen, en verschillende
+    # bestanden met dezelfde naam zitten elkaar niet in de weg. Het splitsen zelf
+    # streamt via ffmpeg en knipt in stiltes (zie audio_segmenter).
+    os.makedirs(podcast_parts_dir, exist_ok=True)
+    extension = os.path.splitext(audio_file.name)[1].lower() or ".mp3"
+    upload_path = os.path.join(podcast_parts_dir, f"upload_{uuid.uuid4().hex}{extension}")
+    audio_hash = spool_to_disk(audio_file, upload_path)
+    try:
+        parts_dir = os.path.join(podcast_parts_dir, f"{audio_hash[:16]}_{chunk_length_ms}")
+        manifest_path = os.path.join(parts_dir, "parts.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                return [AudioChunk(**chunk) for chunk in json.load(f)]
+
+        segments = segment_audio(upload_path, parts_dir, target=chunk_length_ms / 1000)
+        chunks = [AudioChunk(path, start_ms, end_ms, audio_hash) for path, start_ms, end_ms in segments]
+    finally:
+        os.remove(upload_path)
+
+    # Uniek per aanroep: alle sessies draaien in hetzelfde proces
+    tmp_path = f"{manifest_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump([asdict(chunk) for chunk in chunks], f)
+    os.replace(tmp_path, manifest_path)
+    return chunks
+
+
+def format_timecode(ms):
+    seconds = ms // 1000
+    hours, rest = divmod(seconds, 3600)
+    if hours:
+        return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+    return f"{rest // 60}:{rest % 60:02d}"
 
 def get_transcript(audio_file_path, language):
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-    }
-    data = {
-        "model": "whisper-1",
-        "language": language,
-        "response_format": "verbose_json",
-        "timestamp_granularities[]": "segment",
-    }
-    
-    with open(audio_file_path, 'rb') as audio_file:
-        files = {"file": (os.path.basename(audio_file_path), audio_file, "audio/mp3")}
-        response = requests.post("https://api.openai.com/v1/audio/transcriptions", headers=headers, files=files, data=data)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return {"error": "Kon de transcriptie niet ophalen, status code: " + str(response.status_code)}
-
-def generate_shownotes(transcript_json, time_range):
+    return get_client().transcribe(audio_file_path, model=WHISPER_MODEL, language=language,
+                                   response_format="verbose_json",
+                                   **{"timestamp_granularities[]": "segment"})
+
+def generate_shownotes(transcript_json, time_range, offset_seconds=0):
+    # Whisper geeft tijden binnen het segment; met de offset worden het tijden in de hele aflevering
     segments = transcript_json.get('segments', [])
-    segments_str = '\n'.join([f"Start: {seg['start']}s, Einde: {seg['end']}s, Tekst: {seg['text']}" for seg in segments])
+    segments_str = '\n'.join([f"Start: {seg['start'] + offset_seconds:.0f}s, Einde: {seg['end'] + offset_seconds:.0f}s, Tekst: {seg['text']}" for seg in segments])
 
     context = "Je bent een redacteur die helpt bij het genereren van shownotes voor podcast afleveringen. Focus op de belangrijkste punten en onderwerp wisselingen. Produceer de output in een specifieke opmaak: eerst een lijst van topics en bijbehorende timecodes in hele seconden, gevolgd door een opsomming van artikelen of nieuwsfeiten waarnaar in de segmenten gerefereerd wordt."
     prompt = (f"Het volgende segment, van {time_range}, bevat de volgende segmentinformatie:\n{segments_str}\n\n"
@@ -61,100 +90,224 @@ def generate_shownotes(transcript_json, time_range):
 
     combined_input = f"{context}\n\n{prompt}"
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
-    data = {
-        "model": "gpt-4",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": combined_input}
-        ]
-    }
-
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        print("API-call failed, status code:", response.status_code)
-        return None
-    
-def consolidate_shownotes(all_shownotes):
-    context = "Je bent eindredacteur voor een podcast. Bijgevoegd zie je de gegenereerde shownotes voor een podcast aflevering, deze shownotes zijn per 5 minuten gegenereerd. Voeg alle shownotes samen en maak er 1 chronologische lijst van shownotes van. Indien nodig, voeg onderwerpen samen, zorg dat de tijdsaanduidingen overeenkomen met de totale aflevering. Hou het format van de shownotes hetzelfde."
-
-    # Combineer alle shownotes tot één enkele string
-    shownotes_str = "\n\n".join(all_shownotes)
-
-    prompt = f"{context}\n\nHier zijn de shownotes:\n{shownotes_str}\n\nKun je deze samenvoegen tot één chronologische lijst, alsjeblieft?"
-
-    combined_input = prompt
-
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
-    data = {
-        "model": "gpt-4",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": combined_input}
-        ]
-    }
-
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        print("API-call failed, status code:", response.status_code)
+    return get_client().chat([
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": combined_input}
+    ], model=SHOWNOTES_MODEL)
+
+
+# Budget in tokens voor de shownotes in één consolidatie-aanroep. GPT-4 heeft 8k
+# context, dus invoer plus antwoord moeten daar samen ruim in passen.
+CONSOLIDATE_TOKEN_BUDGET = 3000
+# Maximale lengte van één samengevoegde lijst. Twee antwoorden passen samen in
+# het budget, dus elk niveau van de reductie halveert minstens het aantal delen.
+CONSOLIDATE_OUTPUT_TOKENS = int(os.environ.get("CONSOLIDATE_OUTPUT_TOKENS", CONSOLIDATE_TOKEN_BUDGET // 2))
+
+CONSOLIDATE_CONTEXT = ("Je bent eindredacteur voor een podcast. Bijgevoegd zie je de gegenereerde shownotes voor "
+                       "opeenvolgende delen van een podcast aflevering. Voeg alle shownotes samen en maak er 1 "
+                       "chronologische lijst van shownotes van. Indien nodig, voeg onderwerpen samen. De "
+                       "tijdsaanduidingen gelden al voor de totale aflevering: neem ze ongewijzigd over en reken "
+                       "ze niet om. Hou het format van de shownotes hetzelfde.")
+
+
+def merge_shownotes(shownotes, max_tokens=CONSOLIDATE_OUTPUT_TOKENS):
+    shownotes_str = "\n\n".join(shownotes)
+    # Ongeveer 0.6 Nederlandse woorden per token, met wat marge voor de opmaak
+    words = max_tokens // 2
+    prompt = (f"{CONSOLIDATE_CONTEXT} Houd de lijst onder de {words} woorden; vat onderwerpen korter samen "
+              f"als dat nodig is.\n\nHier zijn de shownotes:\n{shownotes_str}\n\n"
+              "Kun je deze samenvoegen tot één chronologische lijst, alsjeblieft?")
+
+    return get_client().chat([
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ], model=SHOWNOTES_MODEL, max_tokens=max_tokens)
+
+
+def group_by_budget(shownotes, budget=CONSOLIDATE_TOKEN_BUDGET):
+    # Aangrenzende shownotes per groep binnen het budget. Een deel dat alleen al
+    # te groot is vormt een eigen groep en wordt los ingekort.
+    groups = []
+    group, group_tokens = [], 0
+    for notes in shownotes:
+        tokens = count_tokens(notes)
+        if group and group_tokens + tokens > budget:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(notes)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _reduce_group(group, output_tokens=CONSOLIDATE_OUTPUT_TOKENS):
+    # Een los deel dat al binnen de uitvoerlengte past gaat ongewijzigd door;
+    # al het andere gaat door merge_shownotes en is daarna hoogstens
+    # output_tokens lang, zodat het volgende niveau weer kan paren
+    if len(group) == 1 and count_tokens(group[0]) <= output_tokens:
+        return group[0]
+    return merge_shownotes(group, output_tokens)
+
+
+def consolidate_shownotes(all_shownotes, budget=CONSOLIDATE_TOKEN_BUDGET, max_workers=MAX_WORKERS, progress=None):
+    # Boomreductie: per niveau worden aangrenzende groepen parallel samengevoegd,
+    # tot er één lijst over is. Past alles in één keer, dan is het één aanroep.
+    # De tijdsaanduidingen zijn al absoluut (zie generate_shownotes), dus de
+    # volgorde van de groepen is de volgorde van de aflevering.
+    level = [notes for notes in all_shownotes if notes]
+    if not level:
         return None
+    if len(level) == 1 or sum(count_tokens(notes) for notes in level) <= budget:
+        return merge_shownotes(level)
+
+    depth = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(level) > 1:
+            depth += 1
+            groups = group_by_budget(level, budget)
+            if progress:
+                progress(depth, len(groups))
+            level = list(pool.map(bind(_reduce_group), groups))
+    return level[0]
+
+def transcribe_chunk(chunk, language, time_range):
+    # Transcriptie en shownotes voor één segment. Uitkomsten worden gecachet op
+    # (audio hash, grenzen, taal, model), zodat een rerun van de pagina niets meer
+    # kost. Draait in een worker thread, dus hier geen Streamlit calls.
+    bounds = [chunk.audio_hash, chunk.start_ms, chunk.end_ms, language]
+    shownotes_key = bounds + [WHISPER_MODEL, SHOWNOTES_MODEL, time_range]
+    cached = get_cached("shownotes", shownotes_key)
+    if cached is not None:
+        return cached, None
+
+    transcript_key = bounds + [WHISPER_MODEL]
+    try:
+        transcript_response = get_cached("transcripts", transcript_key)
+        with span("whisper", items=1, cache_hits=int(transcript_response is not None),
+                  cache_misses=int(transcript_response is None)):
+            if transcript_response is None:
+                transcript_response = get_transcript(chunk.path, language)
+                put_cached("transcripts", transcript_key, transcript_response)
+        with span("llm", items=1):
+            shownotes = generate_shownotes(transcript_response, time_range, chunk.start_ms / 1000)
+    except OpenAIError as exc:
+        return None, str(exc)
+    put_cached("shownotes", shownotes_key, shownotes)
+    return shownotes, None
+
+
+def process_episode(job, audio_file, language, max_workers=MAX_WORKERS):
+    # Draait als achtergrond job. Segmenten worden parallel verwerkt; per segment
+    # start de shownotes stap zodra zijn transcript binnen is. Elk resultaat (of
+    # de fout) komt meteen in het job resultaat, op zijn plek in de aflevering.
+    job.progress("Audio splitsen")
+    with span("audio_split", bytes_in=audio_file.size) as current:
+        chunks = split_and_save_audio(audio_file)
+        current.add(items=len(chunks))
+    segments = [
+        {"time_range": f"{format_timecode(chunk.start_ms)} tot {format_timecode(chunk.end_ms)}",
+         "shownotes": None, "error": None}
+        for chunk in chunks
+    ]
+    job.publish(segments=segments)
+    job.progress("Segmenten", 0, len(chunks))
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            pool.submit(bind(transcribe_chunk), chunk, language, segment["time_range"]): i
+            for i, (chunk, segment) in enumerate(zip(chunks, segments))
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            shownotes, error = future.result()
+            segments[futures[future]].update(shownotes=shownotes, error=error)
+            job.publish(segments=segments)
+            job.progress("Segmenten", done, len(futures))
+    finally:
+        # Bij annuleren starten de segmenten die nog wachten niet meer
+        pool.shutdown(wait=True, cancel_futures=True)
+    return {"segments": segments}
+
+
+def show_segments(segments, placeholders):
+    # Vult alleen de plekken waarvan de uitkomst veranderd is sinds de vorige poll
+    while len(placeholders) < len(segments):
+        placeholders.append((st.empty(), None))
+    for i, segment in enumerate(segments):
+        placeholder, shown = placeholders[i]
+        state = (segment["shownotes"], segment["error"])
+        if state == shown:
+            continue
+        placeholders[i] = (placeholder, state)
+        with placeholder.container():
+            if segment["shownotes"]:
+                st.markdown(f"### Shownotes voor segment {segment['time_range']}")
+                st.write(segment["shownotes"])
+            elif segment["error"]:
+                st.error(f"Segment {segment['time_range']} is mislukt: {segment['error']}")
+            else:
+                st.info(f"Segment {segment['time_range']} wordt verwerkt...")
+
 
 def run_streamlit_app():
+    set_page("shownotes")
     st.title('Podcast Splitter en Transcriptie')
 
     # Tabbladen aanmaken
     tab1, tab2 = st.tabs(["Shownotes Genereren", "Redactie"])
 
-    # Variabele om alle shownotes op te slaan voor het "Redactie" tabblad
-    all_shownotes = []
-
     with tab1:
         uploaded_file = st.file_uploader("Upload je podcast", type=['mp3', 'wav'])
 
         if uploaded_file is not None:
-            chunk_paths = split_and_save_audio(uploaded_file)
             language = st.selectbox("Kies de taal van de audio", ["nl", "en", "de", "fr"], index=0)
+            # Eén job per upload en taal; een rerun van de pagina start niets opnieuw,
+            # en bij een nieuwe job komen segmenten die al klaar waren uit de cache.
+            # Een andere taal of upload vervangt de vorige job, dus die stoppen we.
+            upload_key = [uploaded_file.name, uploaded_file.size, language]
+            if st.session_state.get("shownotes_upload") != upload_key:
+                previous = st.session_state.get("shownotes_job")
+                if previous is not None:
+                    get_job_runner().cancel(previous)
+                st.session_state.shownotes_upload = upload_key
+                st.session_state.shownotes_job = submit_job("shownotes", process_episode, uploaded_file, language)
 
-            for i, chunk_path in enumerate(chunk_paths, start=1):
-                transcript_response = get_transcript(chunk_path, language)
-                if "error" in transcript_response:
-                    st.error(transcript_response["error"])
-                    continue
-
-                time_range = f"{5*(i-1)} tot {5*i} minuten"
-                shownotes = generate_shownotes(transcript_response, time_range)
-                if shownotes:
-                    st.markdown(f"### Shownotes voor segment {time_range}")
-                    st.write(shownotes)
-                    all_shownotes.append(shownotes)
-                else:
-                    st.error("Er is een fout opgetreden bij het genereren van de shownotes.")
+        job = latest_job("shownotes")
+        placeholders = []
+        if job is not None:
+            show_segments(job["result"].get("segments", []), placeholders)
+
+    # Variabele om alle shownotes op te slaan voor het "Redactie" tabblad
+    all_shownotes = []
+    if job_done(job):
+        all_shownotes = [segment["shownotes"] for segment in job["result"]["segments"] if segment["shownotes"]]
 
     with tab2:
         st.markdown("## Alle Shownotes Consolideren")
         if st.button("Consolideer Shownotes"):
             if all_shownotes:
-                consolidated_shownotes = consolidate_shownotes(all_shownotes)
-                if consolidated_shownotes:
+                status = st.empty()
+                try:
+                    with span("consolidate", items=len(all_shownotes)):
+                        consolidated_shownotes = consolidate_shownotes(
+                            all_shownotes,
+                            progress=lambda depth, groups: status.caption(f"Niveau {depth}: {groups} groepen samenvoegen..."))
                     st.markdown("### Geconsolideerde Shownotes")
                     st.write(consolidated_shownotes)
-                else:
-                    st.error("Er is een fout opgetreden bij het consolideren van de shownotes.")
+                except OpenAIError as exc:
+                    st.error(f"Er is een fout opgetreden bij het consolideren van de shownotes: {exc}")
+                status.empty()
             else:
                 st.error("Geen shownotes beschikbaar om te consolideren. Voer eerst de transcriptie uit in Tabblad 1.")
 
+    # Een lopende job volgen in tab 1; segmenten verschijnen zodra ze klaar zijn
+    if job is not None and job["status"] not in FINISHED:
+        with tab1:
+            job = follow_job(job["id"], lambda update: show_segments(update["result"].get("segments", []), placeholders))
+            if job_done(job):
+                st.experimental_rerun()
+
 
 if __name__ == "__main__":
     run_streamlit_app()
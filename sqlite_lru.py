@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Basis voor de caches op schijf die blobs in SQLite bewaren binnen een budget
+# in bytes. last_used houdt de LRU volgorde bij; subclasses kiezen de tabel en
+# de naam van de waardekolom (bestaande databases blijven zo bruikbaar).
+
+
+class SqliteLRU:
+    table = None
+    column = "data"
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"key BLOB PRIMARY KEY, {self.column} BLOB NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)"
+            )
+
+    def _select(self, keys):
+        # Waarden per sleutel; de aanroeper houdt de lock vast
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, {self.column} FROM {self.table} WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[bytes(key)] = bytes(blob)
+        return found
+
+    def _touch(self, keys):
+        now = time.time()
+        self._conn.executemany(
+            f"UPDATE {self.table} SET last_used = ? WHERE key = ?", [(now, key) for key in keys]
+        )
+
+    def _insert(self, items):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, {self.column}, size, last_used) VALUES (?, ?, ?, ?)",
+                [(key, blob, len(key) + len(blob), now) for key, blob in items],
+            )
+        self._evict()
+
+    def _usage(self):
+        return self._conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+        ).fetchone()
+
+    def size_bytes(self):
+        with self._lock:
+            return self._usage()[1]
+
+    def _evict(self):
+        total = self._usage()[1]
+        if total <= self.max_bytes:
+            return
+        # Verwijder de minst recent gebruikte regels tot we weer onder het budget zitten
+        to_delete = []
+        for key, size in self._conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_used"):
+            to_delete.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        with self._conn:
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", to_delete)
@@ -0,0 +1,49 @@
+import os
+import sys
+
+from langchain.schema import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_packing import pack_context
+
+TEXT = ("De gemeente keurt de aanvraag binnen acht weken goed. Daarna volgt een bezwaartermijn van zes "
+        "weken waarin belanghebbenden kunnen reageren. Wie te laat reageert wordt niet ontvankelijk "
+        "verklaard, behalve bij een verschoonbare termijnoverschrijding.")
+
+
+def words(text):
+    return len(text.split())
+
+
+def chunk(start, end, source="a.pdf"):
+    return Document(page_content=TEXT[start:end], metadata={"source": source, "start_index": start})
+
+
+def test_overlapping_chunks_become_one_passage():
+    documents, stats = pack_context([chunk(0, 90), chunk(60, 160)], budget=1000, length_function=words)
+    assert [doc.page_content for doc in documents] == [TEXT[0:160]]
+    assert stats["chunks"] == 2
+    assert stats["passages"] == 1
+
+
+def test_adjacent_chunks_keep_all_text():
+    # "ze" aan het eind en "zeggen" aan het begin is geen overlap: de offsets sluiten aan
+    first = Document(page_content="wij gaan naar huis en ze", metadata={"source": "b.pdf", "start_index": 0})
+    second = Document(page_content="zeggen dat niet", metadata={"source": "b.pdf", "start_index": 24})
+    documents, _ = pack_context([first, second], budget=1000, length_function=words)
+    assert [doc.page_content for doc in documents] == ["wij gaan naar huis en ze\nzeggen dat niet"]
+
+
+def test_duplicates_are_dropped():
+    copy = Document(page_content=TEXT[0:120], metadata={"source": "kopie.pdf", "start_index": 0})
+    documents, stats = pack_context([chunk(0, 120), copy], budget=1000, length_function=words)
+    assert [doc.metadata["source"] for doc in documents] == ["a.pdf"]
+    assert stats["duplicates"] == 1
+
+
+def test_top_k_tokens_counts_the_unpacked_top_k():
+    candidates = [chunk(0, 90), chunk(60, 160), chunk(150, len(TEXT))]
+    _, stats = pack_context(candidates, budget=1000, length_function=words, top_k=2)
+    assert stats["top_k_tokens"] == words(TEXT[0:90]) + words(TEXT[60:160])
+    assert stats["tokens"] == words(TEXT)
@@ -0,0 +1,41 @@
+from functools import lru_cache
+
+# Gedeelde token telling. tiktoken is niet overal beschikbaar (en downloadt
+# zijn tabellen bij eerste gebruik), dus zonder tiktoken schatten we ~4 tekens per token.
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _encoding(encoding_name):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        return None
+
+
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    encoding = _encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def token_length(encoding_name=DEFAULT_ENCODING):
+    return lambda text: count_tokens(text, encoding_name)
+
+
+def pack_batches(texts, max_tokens, max_size):
+    # Indices van opeenvolgende teksten, per batch binnen een token budget en maximum aantal
+    batches = []
+    indices, tokens = [], 0
+    for i, text in enumerate(texts):
+        n = count_tokens(text)
+        if indices and (tokens + n > max_tokens or len(indices) >= max_size):
+            batches.append(indices)
+            indices, tokens = [], 0
+        indices.append(i)
+        tokens += n
+    if indices:
+        batches.append(indices)
+    return batches
@@ -0,0 +1,300 @@
+import atexit
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+# Spans rond elke pipeline stap (kind "stage") en elke aanroep naar een model
+# (kind "model"): duur, tokens, bytes, cache hits en retries, plus een
+# kostenschatting. Een span kent zijn pagina en zijn ouder; kosten en tokens
+# van kinderen tellen mee in de ouder, zodat een stap zijn eigen modelaanroepen
+# bevat. Spans worden gebufferd en in batches naar SQLite geschreven, waar de
+# laatste MAX_SPANS bewaard blijven (een ringbuffer). Met TRACE_EXPORT gaan ze
+# ook als JSON regels naar een bestand.
+TRACES_PATH = os.getenv("TRACES_PATH", os.path.join(".cache", "traces.sqlite3"))
+MAX_SPANS = int(os.getenv("TRACES_MAX_SPANS", 50000))
+TRACE_EXPORT = os.getenv("TRACE_EXPORT")
+FLUSH_SPANS = 100
+FLUSH_INTERVAL = 2.0  # seconden
+
+# Dollar per 1000 tokens (invoer, uitvoer), per minuut audio en per 1000 tekens spraak
+TOKEN_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+TRANSCRIPTION_PRICES = {"whisper-1": 0.006}
+SPEECH_PRICES = {"tts-1": 0.015, "tts-1-hd": 0.03}
+
+COUNTS = ("tokens_in", "tokens_out", "bytes_in", "bytes_out", "audio_seconds", "characters",
+          "items", "cache_hits", "cache_misses", "retries")
+COLUMNS = ("id", "parent", "page", "kind", "name", "model", "started", "duration", "error", "cost") + COUNTS
+
+# (pagina, huidige span) van de lopende code; worker threads krijgen het via bind()
+_state = contextvars.ContextVar("tracing", default=(None, None))
+
+
+def estimate_cost(model, tokens_in=0, tokens_out=0, audio_seconds=0, characters=0, **_):
+    if model in TOKEN_PRICES:
+        price_in, price_out = TOKEN_PRICES[model]
+        return (tokens_in * price_in + tokens_out * price_out) / 1000
+    if model in TRANSCRIPTION_PRICES:
+        return audio_seconds / 60 * TRANSCRIPTION_PRICES[model]
+    if model in SPEECH_PRICES:
+        return characters / 1000 * SPEECH_PRICES[model]
+    return 0.0
+
+
+class Span:
+
+    def __init__(self, name, kind, page, parent, model=None, **counts):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.kind = kind
+        self.page = page
+        self.parent = parent
+        self.model = model
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.duration = 0.0
+        self.error = None
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.counts.update(counts)
+        # Van kinderen, apart van de eigen tellingen: de eigen kosten komen uit de eigen tokens
+        self.child_cost = 0.0
+        self.child_tokens = [0, 0]
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def set(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                if name in self.counts:
+                    self.counts[name] = value
+                else:
+                    setattr(self, name, value)
+
+    def row(self):
+        counts = dict(self.counts)
+        cost = estimate_cost(self.model, **counts) + self.child_cost
+        counts["tokens_in"] += self.child_tokens[0]
+        counts["tokens_out"] += self.child_tokens[1]
+        return dict(id=self.id, parent=self.parent.id if self.parent else None, page=self.page, kind=self.kind,
+                    name=self.name, model=self.model, started=self.started, duration=self.duration,
+                    error=self.error, cost=cost, **counts)
+
+
+def _finish(span):
+    row = span.row()
+    parent = span.parent
+    if parent is not None:
+        with parent._lock:
+            parent.child_cost += row["cost"]
+            parent.child_tokens[0] += row["tokens_in"]
+            parent.child_tokens[1] += row["tokens_out"]
+    get_trace_store().record(row)
+
+
+def set_page(page):
+    _state.set((page, None))
+
+
+def current_span():
+    return _state.get()[1]
+
+
+def bind(fn):
+    # Voor werk dat in een andere thread draait: pagina en ouder span gaan mee
+    state = _state.get()
+
+    def run(*args, **kwargs):
+        token = _state.set(state)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _state.reset(token)
+
+    return run
+
+
+def start_span(name, kind="stage", model=None, parent=None, **counts):
+    # Voor code die begin en einde als losse gebeurtenissen ziet (langchain
+    # callbacks): de span wordt niet de huidige span, finish_span sluit hem af
+    page, current = _state.get()
+    return Span(name, kind, page, parent or current, model, **counts)
+
+
+def finish_span(span, error=None):
+    span.duration = time.perf_counter() - span.clock
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"[:500]
+    _finish(span)
+
+
+@contextmanager
+def span(name, kind="stage", model=None, **counts):
+    page, parent = _state.get()
+    current = Span(name, kind, page, parent, model, **counts)
+    token = _state.set((page, current))
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as exc:
+        current.error = f"{type(exc).__name__}: {exc}"[:500]
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _state.reset(token)
+        _finish(current)
+
+
+_iter_stack = threading.local()
+
+
+def traced_iter(name, iterable, **counts):
+    # Span over een generator stap die lui geconsumeerd wordt: alleen de tijd in
+    # next() telt, min de tijd van een getraceerde generator daarbinnen (zo
+    # telt het chunken niet de PDF extractie mee). items telt de elementen.
+    page, parent = _state.get()
+    current = Span(name, "stage", page, parent, **counts)
+    iterator = iter(iterable)
+    stack = _iter_stack.__dict__.setdefault("stack", [])
+    try:
+        while True:
+            token = _state.set((page, current))
+            stack.append(current)
+            current.nested = 0.0
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed = time.perf_counter() - started
+                stack.pop()
+                _state.reset(token)
+                current.duration += elapsed - current.nested
+                if stack:
+                    stack[-1].nested += elapsed
+            current.add(items=1)
+            yield item
+    except Exception as exc:
+        current.error = f"{type(exc).__name__}: {exc}"[:500]
+        raise
+    finally:
+        _finish(current)
+
+
+class TraceStore:
+
+    def __init__(self, path=TRACES_PATH, max_spans=MAX_SPANS, export_path=TRACE_EXPORT):
+        self.path = path
+        self.max_spans = max_spans
+        self.export_path = export_path
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS spans (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id TEXT NOT NULL, parent TEXT, page TEXT, kind TEXT NOT NULL, name TEXT NOT NULL, "
+                "model TEXT, started REAL NOT NULL, duration REAL NOT NULL, error TEXT, cost REAL NOT NULL, "
+                + ", ".join(f"{name} REAL NOT NULL DEFAULT 0" for name in COUNTS) + ")"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS spans_started ON spans (started)")
+        atexit.register(self.flush)
+
+    def record(self, row):
+        with self._lock:
+            self._buffer.append(row)
+            if len(self._buffer) < FLUSH_SPANS and time.monotonic() - self._last_flush < FLUSH_INTERVAL:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT INTO spans ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    [tuple(row[name] for name in COLUMNS) for row in rows],
+                )
+                # Ringbuffer: alleen de laatste max_spans blijven staan
+                self._conn.execute("DELETE FROM spans WHERE seq <= (SELECT MAX(seq) FROM spans) - ?",
+                                   (self.max_spans,))
+            if self.export_path:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(row) + "\n" for row in rows)
+
+    def spans(self, since=0.0):
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM spans WHERE started >= ? ORDER BY seq", (since,)
+            ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def summary(self, since=0.0, kind="stage", by=("page", "name")):
+        # Per groep: aantal, fouten, p50/p95 latency, tokens, kosten en cache hit rate
+        groups = {}
+        for row in self.spans(since):
+            if row["kind"] == kind:
+                groups.setdefault(tuple(row[key] for key in by), []).append(row)
+        summary = []
+        for key, rows in sorted(groups.items(), key=lambda item: [str(part) for part in item[0]]):
+            durations = [row["duration"] for row in rows]
+            hits = sum(row["cache_hits"] for row in rows)
+            lookups = hits + sum(row["cache_misses"] for row in rows)
+            summary.append(dict(
+                zip(by, key),
+                calls=len(rows),
+                errors=sum(1 for row in rows if row["error"]),
+                p50=float(np.percentile(durations, 50)),
+                p95=float(np.percentile(durations, 95)),
+                tokens_in=int(sum(row["tokens_in"] for row in rows)),
+                tokens_out=int(sum(row["tokens_out"] for row in rows)),
+                bytes=int(sum(row["bytes_in"] + row["bytes_out"] for row in rows)),
+                retries=int(sum(row["retries"] for row in rows)),
+                cache_hit_rate=hits / lookups if lookups else None,
+                cost=sum(row["cost"] for row in rows),
+            ))
+        return summary
+
+    def export_jsonl(self, since=0.0):
+        return "".join(json.dumps(row) + "\n" for row in self.spans(since))
+
+    def clear(self):
+        with self._lock:
+            self._buffer = []
+            with self._conn:
+                self._conn.execute("DELETE FROM spans")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_trace_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TraceStore()
+        return _store
@@ -0,0 +1,122 @@
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_cache import audio_key, get_audio_cache
+from openai_client import get_client
+from tracing import bind, traced_iter
+
+# Lange teksten worden op zinsgrenzen in stukken verdeeld die parallel naar de
+# TTS API gaan. De stukken komen in volgorde terug zodra ze klaar zijn, zodat het
+# eerste deel al afgespeeld kan worden terwijl de rest nog gemaakt wordt. MP3
+# frames zijn los decodeerbaar, dus de delen worden zonder hercodering aan
+# elkaar geplakt. Stukken overschrijden geen alinea's, zodat een wijziging in
+# één alinea de andere stukken (en hun cache entries, zie audio_cache) ongemoeid laat.
+TTS_MODEL = "tts-1"
+TTS_INPUT_LIMIT = 4096  # maximum aantal tekens per aanroep van de API
+FIRST_SEGMENT_CHARS = 400  # kort eerste stuk: sneller iets te horen
+SEGMENT_CHARS = 1500
+MAX_WORKERS = 4
+SPEECH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "speech")
+SPEECH_MAX_AGE = 24 * 3600  # oudere uitvoerbestanden worden opgeruimd
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _split_long(sentence, limit):
+    # Een zin langer dan de limiet gaat bij voorkeur op een komma uit elkaar,
+    # en alleen als er geen komma is op een spatie
+    parts = []
+    while len(sentence) > limit:
+        cut = sentence.rfind(", ", 0, limit)
+        if cut <= 0:
+            cut = sentence.rfind(" ", 0, limit)
+        cut = cut + 1 if cut > 0 else limit
+        parts.append(sentence[:cut].strip())
+        sentence = sentence[cut:].strip()
+    return parts + [sentence] if sentence else parts
+
+
+def split_for_tts(text, first_chars=FIRST_SEGMENT_CHARS, chars=SEGMENT_CHARS, limit=TTS_INPUT_LIMIT):
+    segments = []
+    for paragraph in re.split(r"\n\s*", text):
+        current = ""
+        for sentence in _SENTENCE_END.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            for part in _split_long(sentence, limit):
+                target = first_chars if not segments else chars
+                if current and len(current) + 1 + len(part) > min(target, limit):
+                    segments.append(current)
+                    current = part
+                else:
+                    current = f"{current} {part}" if current else part
+        if current:
+            segments.append(current)
+    return segments
+
+
+def _strip_id3(data):
+    # Een ID3v2 tag aan het begin hoort alleen in het eerste deel thuis
+    if data[:3] != b"ID3" or len(data) < 10:
+        return data
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return data[10 + size:]
+
+
+def _synthesize(segment, voice, model, key):
+    audio = get_client().speech(segment, voice, model)
+    get_audio_cache().put(key, audio)
+    return audio
+
+
+def iter_speech(text, voice, model=TTS_MODEL, max_workers=MAX_WORKERS):
+    # Geeft (index, aantal, mp3 bytes) per stuk, in volgorde. Alleen stukken die
+    # niet in de audio cache staan gaan naar de API.
+    segments = split_for_tts(text)
+    cache = get_audio_cache()
+    keys = [audio_key(segment, voice, model) for segment in segments]
+    cached = [cache.get(key) for key in keys]
+    hits = sum(audio is not None for audio in cached)
+    return traced_iter("tts", _iter_parts(segments, keys, cached, voice, model, max_workers),
+                       cache_hits=hits, cache_misses=len(segments) - hits)
+
+
+def _iter_parts(segments, keys, cached, voice, model, max_workers):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            None if audio is not None else pool.submit(bind(_synthesize), segment, voice, model, key)
+            for segment, key, audio in zip(segments, keys, cached)
+        ]
+        for i, future in enumerate(futures):
+            yield i, len(segments), cached[i] if future is None else future.result()
+
+
+def join_mp3(parts):
+    return b"".join(part if i == 0 else _strip_id3(part) for i, part in enumerate(parts))
+
+
+def new_speech_path():
+    os.makedirs(SPEECH_DIR, exist_ok=True)
+    cutoff = time.time() - SPEECH_MAX_AGE
+    for name in os.listdir(SPEECH_DIR):
+        path = os.path.join(SPEECH_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+    # Uniek per aanvraag, zodat gelijktijdige gebruikers elkaars bestand niet overschrijven
+    return os.path.join(SPEECH_DIR, f"speech_{uuid.uuid4().hex}.mp3")
+
+
+def write_speech(parts):
+    path = new_speech_path()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(join_mp3(parts))
+    os.replace(tmp_path, path)
+    return path